@@ -1,12 +1,9 @@
-import inspect
+import os
 import re
 import sys
 from datetime import date, datetime, timedelta
-from pathlib import Path
 from typing import Any, Callable, Dict, Iterable, List, Tuple, Type, Union
 
-from dateutil.parser import parse as dt_parse
-
 
 def cleanup_misc_chars(display_name):
     """
@@ -105,6 +102,13 @@ def to_timedelta(s: str) -> timedelta:
     )
 
 
+def dt_parse(s: str) -> datetime:
+    # dateutil is slow to import and not needed to print usage
+    from dateutil.parser import parse
+
+    return parse(s)
+
+
 def dt_iso_parse(s):
     return dt_parse(s).replace(tzinfo=None)
 
@@ -148,36 +152,93 @@ def filter_options(ll: Iterable[str]) -> Tuple[List[str], Dict[str, Any]]:
     return filtered, options
 
 
+def public_methods(cls: Type) -> List[str]:
+    return [f for f in dir(cls) if not f.startswith("_") and callable(getattr(cls, f))]
+
+
+CO_VARARGS = 0x04
+
+USAGES_CACHE: Dict[Tuple[Type, str], str] = {}
+
+
+def usages(cls: Type, script: str) -> str:
+    """
+    Help text for all public methods of `cls`. Reads signatures directly
+    from code objects to avoid importing `inspect`
+
+    >>> class X:
+    ...     def a(self, x, y=None):
+    ...         pass
+    ...     def b(self, x, *ys):
+    ...         pass
+    ...     def _hidden(self):
+    ...         pass
+    ...
+    >>> print(usages(X, "x"))
+    <BLANKLINE>
+    USAGES:
+     x a <x> [y]
+     x b <x> <ys...>
+    <BLANKLINE>
+    """
+    if (cls, script) in USAGES_CACHE:
+        return USAGES_CACHE[(cls, script)]
+    h = []
+    h.append("\nUSAGES:")
+    for a in public_methods(cls):
+        code = getattr(cls, a).__code__
+        names = code.co_varnames[: code.co_argcount]
+        defaults = getattr(cls, a).__defaults__ or ()
+        optonals = set(names[len(names) - len(defaults) :])
+        a_args = " ".join(f"[{n}]" if n in optonals else f"<{n}>" for n in names[1:])
+        if code.co_flags & CO_VARARGS:
+            a_args += f" <{code.co_varnames[code.co_argcount]}...>"
+        h.append(f" {script} {a} {a_args}")
+    h.append("")
+    USAGES_CACHE[(cls, script)] = "\n".join(h)
+    return USAGES_CACHE[(cls, script)]
+
+
+def needs(*subtrees: str):
+    """
+    Declares state subtrees that action uses, so they could be loaded up
+    front. Function is not wrapped, so usage still sees its arguments.
+
+    >>> @needs("acrs")
+    ... def f(x):
+    ...     pass
+    >>> f.needs, f.__code__.co_varnames
+    (('acrs',), ('x',))
+    """
+
+    def decorate(fn):
+        setattr(fn, "needs", subtrees)
+        return fn
+
+    return decorate
+
+
 class CliActions:
     def __init__(self, script=sys.argv[0]):
         if "-m" == script:
             script = __name__
         else:
-            script = Path(script).name
-        cls = type(self)
-        self._actions = [f for f in dir(cls) if not f.startswith("_")]
-        h = []
-        h.append("\nUSAGES:")
-        for a in self._actions:
-            fn = getattr(cls, a)
-            names, _, _, defaults = inspect.getfullargspec(fn)[:4]
-            if defaults is None:
-                defaults = ()
-            def_offset = len(names) - len(defaults)
-            optonals = {k: v for k, v in zip(names[def_offset:], defaults)}
-            a_args = " ".join(
-                f"[{n}]" if n in optonals else f"<{n}>" for n in names[1:]
-            )
-            h.append(f" {script} {a} {a_args}")
-        h.append("")
+            script = os.path.basename(script)
+        self._script = script
+        self._actions = public_methods(type(self))
         self._show_help = False
-        self._help = "\n".join(h)
+        self._errors: List[str] = []
+        self._needs: Tuple[str, ...] = ()
+
+    @property
+    def _help(self) -> str:
+        return "".join(self._errors) + usages(type(self), self._script)
 
     def _check_action(self, act):
         if act in self._actions:
             return True
         else:
-            self._help = f"{act} is not valid action\n" + self._help
+            self._errors.insert(0, f"{act} is not valid action\n")
             self._show_help = True
             return False
 
@@ -185,7 +246,9 @@ class CliActions:
         if not self._show_help:
             act = args[0]
             if self._check_action(act):
-                return getattr(self, act)(*args[1:])
+                method = getattr(self, act)
+                self._needs = getattr(method, "needs", ())
+                return method(*args[1:])
         return ""
 
 
@@ -1,9 +1,30 @@
+import codecs
+import http.client
 import json
+import os
+import random
+import re
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Tuple, Union
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from azup import (
     cleanup_misc_chars,
@@ -11,7 +32,9 @@ from azup import (
     educated_guess,
     filter_options,
     print_err,
+    to_timedelta,
 )
+from azup.rest import RestClient, RestError, TokenCache, token_expiry
 
 REC_DIR = Path("recordings")
 
@@ -22,6 +45,8 @@ def ensure_recdir():
 
 
 TESTER = REC_DIR / "tester.json"
+# one case per line, so adding a case does not rewrite whole catalog
+TESTER_LOG = REC_DIR / "tester.jsonl"
 
 
 class ReplayTest:
@@ -41,44 +66,274 @@ class ReplayTest:
 
 def add_test(args: List[str], out: str):
     ensure_recdir()
-    tests = json.load(TESTER.open("rt")) if TESTER.exists() else []
-    tests.append({"args": args, "out": out, "now": datetime.utcnow().isoformat()})
-    json.dump(tests, TESTER.open("wt"))
+    test = {"args": args, "out": out, "now": datetime.utcnow().isoformat()}
+    with TESTER_LOG.open("at") as fp:
+        fp.write(json.dumps(test) + "\n")
 
 
 def read_tests():
+    """
+    Cases from legacy `tester.json` followed by ones from `tester.jsonl`
+    """
     tests = json.load(TESTER.open("rt")) if TESTER.exists() else []
+    if TESTER_LOG.exists():
+        with TESTER_LOG.open("rt") as fp:
+            tests.extend(json.loads(line) for line in fp if line.strip())
     return [(r["args"], dt_iso_parse(r["now"]), r["out"]) for r in tests]
 
 
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """
+    Decodes top level json array element by element, so only one element
+    and unparsed tail of current chunk kept in memory
+
+    >>> list(iter_json_array(['[{"a": 1}, ', '{"b"', ': [2, 3]}', ']']))
+    [{'a': 1}, {'b': [2, 3]}]
+    >>> list(iter_json_array(['[1', '2, 3', ']']))
+    [12, 3]
+    >>> list(iter_json_array(['[1.', '5e', '3]']))
+    [1500.0]
+    >>> items = iter_json_array(['[1, 2', ' x]'])
+    >>> next(items)
+    1
+    >>> list(items)
+    Traceback (most recent call last):
+    ...
+    ValueError: not json array, at: 'x]'
+    >>> list(iter_json_array([' [ ] ']))
+    []
+    >>> list(iter_json_array(['[1,,2]']))
+    Traceback (most recent call last):
+    ...
+    ValueError: not json array, at: ',2]'
+    >>> list(iter_json_array(['[1,]']))
+    Traceback (most recent call last):
+    ...
+    ValueError: not json array, at: ']'
+    >>> list(iter_json_array(['[{}', '{}]']))
+    Traceback (most recent call last):
+    ...
+    ValueError: not json array, at: '{}]'
+    >>> list(iter_json_array(['{}']))
+    Traceback (most recent call last):
+    ...
+    ValueError: not json array: '{}'
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    # "[", then "first" element or "]", "delim" after element, "item" after ","
+    expect = "["
+    eof = False
+
+    def more() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        for chunk in chunks:
+            buf = buf[pos:] + chunk
+            pos = 0
+            return True
+        eof = True
+        return False
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+        if pos == len(buf):
+            if more():
+                continue
+            raise ValueError("unexpected end of json array")
+        if expect == "[":
+            if buf[pos] != "[":
+                raise ValueError(f"not json array: {buf[pos:pos + 20]!r}")
+            expect = "first"
+            pos += 1
+            continue
+        if buf[pos] == "]" and expect in ("first", "delim"):
+            return
+        if expect == "delim" and buf[pos] == ",":
+            expect = "item"
+            pos += 1
+            continue
+        if expect == "delim" or buf[pos] in ",]":
+            raise ValueError(f"not json array, at: {buf[pos:pos + 20]!r}")
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if more():
+                continue
+            raise
+        after = end
+        while after < len(buf) and buf[after] in " \t\r\n":
+            after += 1
+        if after == len(buf) or buf[after] not in ",]":
+            # item is complete only when delimiter follows it, number could
+            # be split anywhere across chunks: decode again with more data
+            if more():
+                continue
+        pos = end
+        expect = "delim"
+        yield item
+
+
+CHUNK_SIZE = 64 * 1024
+TIMEOUT_RC = 124  # same as timeout(1)
+
+# Seconds before command killed, by command family. See `family_of`
+TIMEOUTS = {
+    "read": 5 * 60,
+    "create": 30 * 60,
+    "delete": 20 * 60,
+    "restart": 15 * 60,
+    "other": 10 * 60,
+}
+
+
+def kill_group(process: subprocess.Popen):
+    """
+    Kills process with its descendants, process is expected to be started in
+    session of its own. `az` is a shell script running python, killing just
+    the script leaves python running and holding the pipes.
+    """
+    try:
+        os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+    except ProcessLookupError:  # exited and reaped already
+        pass
+
+
 class CmdRun:
     cmd: str
     out: str
     err: str
     rc: int
+    elapsed: Optional[float]  # wall seconds, when it was actually run
+    process: Optional[subprocess.Popen]
+    killer: Optional[threading.Timer]
+    err_file: IO[bytes]
 
-    def __init__(self, cmd, rc=None, out=None, err=None, log=print_err):
+    def __init__(
+        self,
+        cmd,
+        rc=None,
+        out=None,
+        err=None,
+        log=print_err,
+        stream=False,
+        timeout: float = None,
+    ):
+        """
+        :param timeout: seconds after which child process is killed and
+            run reported with `TIMEOUT_RC`
+        """
         self.cmd = cmd
+        self.process = None
+        self.timeout = timeout
+        self.elapsed = None
+        self.killer = None
+        self.timed_out = False
         if rc is None:
             log(f"run: {cmd}")
-            process = subprocess.run(cmd.split(), capture_output=True)
-            self.rc = process.returncode
-            self.out = process.stdout.decode("utf-8")
-            self.err = process.stderr.decode("utf-8")
+            if stream:
+                self.err_file = tempfile.TemporaryFile()
+                self.process = subprocess.Popen(
+                    cmd.split(),
+                    stdout=subprocess.PIPE,
+                    stderr=self.err_file,
+                    start_new_session=True,
+                )
+                if timeout is not None:
+                    self.killer = threading.Timer(timeout, self.kill_timed_out)
+                    self.killer.daemon = True  # does not hold interpreter exit
+                    self.killer.start()
+                self.rc = None
+                self.out = ""
+                self.err = ""
+            else:
+                process = subprocess.Popen(
+                    cmd.split(),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    start_new_session=True,
+                )
+                try:
+                    out, err = process.communicate(timeout=timeout)
+                    self.rc = process.returncode
+                    self.out = out.decode("utf-8")
+                    self.err = err.decode("utf-8")
+                except subprocess.TimeoutExpired:
+                    kill_group(process)
+                    process.communicate()
+                    self.set_timed_out()
         else:
             self.err = err or ""
             self.out = out or ""
             self.rc = rc
 
+    def iter_out(self) -> Iterator[str]:
+        """
+        Yields stdout in chunks. When process was started with `stream=True`
+        output is not retained in `out`, and `rc` and `err` are set only
+        after stdout is exhausted.
+        """
+        if self.process is None:
+            yield self.out
+            return
+        reader = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            data = self.process.stdout.read(CHUNK_SIZE)
+            if not data:
+                break
+            yield reader.decode(data)
+        yield reader.decode(b"", final=True)
+        self.rc = self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+        self.err_file.seek(0)
+        self.err = self.err_file.read().decode("utf-8")
+        self.err_file.close()
+        self.stop_killer()
+        if self.timed_out and self.rc != 0:
+            self.set_timed_out()
+
+    def kill_timed_out(self):
+        self.timed_out = True
+        process = self.process
+        if process is not None:
+            kill_group(process)
+
+    def stop_killer(self):
+        if self.killer is not None:
+            self.killer.cancel()
+
+    def set_timed_out(self):
+        self.rc = TIMEOUT_RC
+        self.out = ""
+        self.err = f"ERROR: timed out, killed after {self.timeout}s"
+
     def to_list(self) -> List[Any]:
-        return [self.cmd, self.rc, self.out, self.err]
+        """
+        >>> CmdRun("a", 0, "x").to_list()
+        ['a', 0, 'x', '']
+        >>> run = CmdRun.from_list(["a", 0, "x", "", 1.5])
+        >>> run.elapsed, run.to_list()
+        (1.5, ['a', 0, 'x', '', 1.5])
+        """
+        ll = [self.cmd, self.rc, self.out, self.err]
+        if self.elapsed is not None:
+            ll.append(round(self.elapsed, 3))
+        return ll
 
     @staticmethod
     def from_list(ll: Iterable[Any]):
-        return CmdRun(*ll)
+        cmd, rc, out, err, *elapsed = ll
+        run = CmdRun(cmd, rc, out, err)
+        run.elapsed = elapsed[0] if elapsed else None
+        return run
 
     def __repr__(self):
-        return f"CmdRun({json.dumps(self.to_list())[1:-1]})"
+        return f"CmdRun({json.dumps(self.to_list()[:4])[1:-1]})"
 
 
 class Player:
@@ -96,28 +351,90 @@ class Player:
     Traceback (most recent call last):
     ...
     ValueError: expected:a but called:b
-    >>>
+    >>> p = Player([["a",0,'1','',0.2], ["b",0,'2',''], ["a",0,'3','',0.1]],
+    ...     latency=0, strict=False)
+    >>> [p.get(cmd).out for cmd in ("b", "a", "a")]
+    ['2', '1', '3']
+    >>> p.assert_at_the_end()
+    >>> p.report()["recorded"]
+    0.3
     """
 
     records: List[CmdRun]
     idx: int
 
-    def __init__(self, ll: Iterable[Iterable[Any]]):
+    def __init__(
+        self,
+        ll: Iterable[Iterable[Any]],
+        latency: float = None,
+        jitter: float = 0,
+        strict: bool = True,
+    ):
+        """
+        :param latency: sleep recorded time of each command multiplied by
+            `latency`, to compare execution strategies offline
+        :param jitter: spread of sleep, i.e. 0.2 for +-20%
+        :param strict: commands expected in recorded order, otherwise next
+            unplayed record of the same command is returned
+        """
         self.idx = 0
         self.records = list(map(CmdRun.from_list, ll))
+        self.latency = latency
+        self.jitter = jitter
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.unplayed: Dict[str, List[CmdRun]] = {}
+        for run in reversed(self.records):
+            self.unplayed.setdefault(run.cmd, []).append(run)
+        self.played: List[Tuple[CmdRun, float, float]] = []
 
     def get(self, cmd) -> CmdRun:
-        result = self.records[self.idx]
-        if result.cmd != cmd:
-            raise ValueError(f"expected:{result.cmd} but called:{cmd}")
-        else:
+        with self.lock:
+            if self.strict:
+                result = self.records[self.idx]
+                if result.cmd != cmd:
+                    raise ValueError(f"expected:{result.cmd} but called:{cmd}")
+            else:
+                if not self.unplayed.get(cmd):
+                    raise ValueError(f"not recorded or played already:{cmd}")
+                result = self.unplayed[cmd].pop()
             self.idx += 1
-            return result
+        start = time.monotonic()
+        if self.latency is not None and result.elapsed:
+            spread = random.uniform(1 - self.jitter, 1 + self.jitter)
+            time.sleep(result.elapsed * self.latency * spread)
+        with self.lock:
+            self.played.append((result, start, time.monotonic()))
+        return result
 
     def assert_at_the_end(self):
         if self.idx != len(self.records):
             raise ValueError(f"idx:{self.idx} not at the end:{len(self.records)}")
 
+    def report(self) -> Dict[str, Any]:
+        """
+        Recorded time of played commands if run one by one, against wall
+        time they took in replay, which is critical path of the strategy
+        used
+        """
+        with self.lock:
+            played = list(self.played)
+        recorded = sum(run.elapsed or 0 for run, _, _ in played)
+        wall = (
+            max(end for _, _, end in played) - min(start for _, start, _ in played)
+            if played
+            else 0.0
+        )
+        return {
+            "played": len(played),
+            "untimed": sum(1 for run, _, _ in played if run.elapsed is None),
+            "recorded": round(recorded, 3),
+            "wall": round(wall, 3),
+            "speedup": (
+                round(recorded * (self.latency or 0) / wall, 2) if wall else None
+            ),
+        }
+
 
 RECORDS = "records"
 CMD_LINE = "cmdLine"
@@ -134,6 +451,7 @@ class Recorder:
     records: List[List[Any]]
 
     def __init__(self, file: str, cmd_line: List[str]):
+        self.lock = threading.Lock()
         ensure_recdir()
         if file.endswith("*"):
             next_num = len(list(REC_DIR.glob(file)))
@@ -158,8 +476,317 @@ class Recorder:
         json.dump(self.content, self.file.open("wt"))
 
     def record(self, run: CmdRun):
-        self.records.append(run.to_list())
-        self.write()
+        with self.lock:
+            self.records.append(run.to_list())
+            self.write()
+
+
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+THROTTLED_RE = re.compile(r"\b429\b|TooManyRequests|throttl|rate limit", re.I)
+TRANSIENT_RE = re.compile(
+    r"\b50[0234]\b|InternalServerError|ServiceUnavailable|BadGateway"
+    r"|GatewayTimeout|Connection ?(reset|aborted|error)|timed out|temporarily",
+    re.I,
+)
+NOT_FOUND_RE = re.compile(r"ResourceNotFound|\bnot (be )?found\b", re.I)
+RETRY_AFTER_RE = re.compile(r"retry[- ]after\D{0,5}(\d+)", re.I)
+READ_VERBS = {"list", "show", "show-manifests", "list-locations"}
+
+
+def classify(run: CmdRun) -> Optional[str]:
+    """
+    >>> classify(CmdRun("a", 0))
+    >>> classify(CmdRun("a", 1, err="(TooManyRequests) Too many requests"))
+    'throttled'
+    >>> classify(CmdRun("a", 1, err="Operation returned 503 ServiceUnavailable"))
+    'transient'
+    >>> classify(CmdRun("a", 3, err="(ResourceNotFound) not found"))
+    'permanent'
+    """
+    if run.rc == 0:
+        return None
+    if THROTTLED_RE.search(run.err):
+        return THROTTLED
+    if TRANSIENT_RE.search(run.err):
+        return TRANSIENT
+    return PERMANENT
+
+
+def retry_after(run: CmdRun) -> Optional[float]:
+    """
+    >>> retry_after(CmdRun("a", 1, err="429 ... Retry-After: 17"))
+    17.0
+    >>> retry_after(CmdRun("a", 1, err="429"))
+    """
+    m = RETRY_AFTER_RE.search(run.err)
+    return float(m.group(1)) if m else None
+
+
+def is_read(cmd: str) -> bool:
+    """
+    >>> is_read("az webapp config appsettings list -n x -g y")
+    True
+    >>> is_read("az webapp create -n x -g y")
+    False
+    >>> is_read("az rest --method post --uri https://x/batch?api-version=1 --body {}")
+    True
+    >>> is_read("az rest --method put --uri /x/config/appsettings?api-version=1")
+    False
+    """
+    words = cmd.split()
+    if words[1:2] == ["rest"]:
+        method = words[words.index("--method") + 1] if "--method" in words else "get"
+        uri = words[words.index("--uri") + 1] if "--uri" in words else ""
+        return method == "get" or uri.split("?")[0].endswith(("/batch", "/list"))
+    return any(w in READ_VERBS for w in words[:5])
+
+
+def service_of(cmd: str) -> str:
+    """
+    >>> service_of("az webapp list -g x")
+    'webapp'
+    """
+    words = cmd.split()
+    return words[1] if len(words) > 1 else words[0]
+
+
+def family_of(cmd: str) -> str:
+    """
+    >>> family_of("az webapp list -g x"), family_of("az webapp create -n x")
+    ('read', 'create')
+    >>> family_of("az webapp config appsettings set -n x")
+    'other'
+    """
+    if is_read(cmd):
+        return "read"
+    words = cmd.split()[:5]
+    for family in ("create", "delete", "restart"):
+        if family in words:
+            return family
+    return "other"
+
+
+def parse_timeouts(s: str) -> Dict[str, float]:
+    """
+    >>> parse_timeouts("read=90s,create=1h")
+    {'read': 90.0, 'create': 3600.0}
+    """
+    out = {}
+    for pair in s.split(","):
+        family, t = pair.split("=")
+        out[family] = to_timedelta(t).total_seconds()
+    return out
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Window:
+    size: float
+    active: int
+
+    def __init__(self, size: float):
+        self.size = size
+        self.active = 0
+
+
+class RateControl:
+    """
+    Limits number of concurrent commands per service with window that grows
+    additively on success and halves on throttling (AIMD), and computes
+    jittered exponential backoff for retries.
+
+    >>> rc = RateControl(initial=4)
+    >>> rc.observe("webapp", None); round(rc.windows["webapp"].size, 2)
+    4.25
+    >>> rc.observe("webapp", THROTTLED); round(rc.windows["webapp"].size, 2)
+    2.12
+    >>> rc.stats()["throttled"]
+    1
+    >>> 0 < rc.backoff(3) <= 8
+    True
+    """
+
+    windows: Dict[str, Window]
+    counters: Dict[str, int]
+
+    def __init__(
+        self,
+        initial: float = 4,
+        maximum: float = 32,
+        max_attempts: int = 6,
+        base_delay: float = 1,
+        max_delay: float = 60,
+    ):
+        self.initial = initial
+        self.maximum = maximum
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cond = threading.Condition()
+        self.windows = {}
+        self.counters = {"runs": 0, "retries": 0, THROTTLED: 0, TRANSIENT: 0}
+
+    def window(self, service: str) -> Window:
+        if service not in self.windows:
+            self.windows[service] = Window(self.initial)
+        return self.windows[service]
+
+    @contextmanager
+    def slot(self, service: str, deadline: float = None):
+        with self.cond:
+            w = self.window(service)
+            while w.active >= max(1, int(w.size)):
+                if deadline is None:
+                    self.cond.wait()
+                elif not self.cond.wait(max(0, deadline - time.monotonic())):
+                    raise DeadlineExceeded(f"deadline passed waiting for {service}")
+            w.active += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                w.active -= 1
+                self.cond.notify_all()
+
+    def observe(self, service: str, outcome: Optional[str]):
+        with self.cond:
+            w = self.window(service)
+            self.counters["runs"] += 1
+            if outcome == THROTTLED:
+                w.size = max(1.0, w.size / 2)
+            elif outcome is None:
+                w.size = min(self.maximum, w.size + 1 / w.size)
+            if outcome in (THROTTLED, TRANSIENT):
+                self.counters[outcome] += 1
+            self.cond.notify_all()
+
+    def should_retry(self, cmd: str, run: CmdRun, attempt: int) -> bool:
+        outcome = classify(run)
+        retry = attempt + 1 < self.max_attempts and (
+            outcome == THROTTLED or (outcome == TRANSIENT and is_read(cmd))
+        )
+        if retry:
+            with self.cond:
+                self.counters["retries"] += 1
+        return retry
+
+    def backoff(self, attempt: int, hint: float = None) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        return delay if hint is None else max(hint, delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                **self.counters,
+                "windows": {k: round(w.size, 2) for k, w in self.windows.items()},
+            }
+
+
+class Flight:
+    event: threading.Event
+    run: Optional[CmdRun]
+    stale: bool
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.run = None
+        self.stale = False
+
+
+class Memo:
+    """
+    Successful outputs of read commands keyed by command line. Concurrent
+    callers of the same command wait for the first one and share its result
+    instead of running it again.
+
+    >>> memo = Memo()
+    >>> memo.get("a x", lambda: CmdRun("a x", 0, "1"))
+    CmdRun("a x", 0, "1", "")
+    >>> memo.get("a x", lambda: CmdRun("a x", 0, "2"))
+    CmdRun("a x", 0, "1", "")
+    >>> memo.get("b", lambda: CmdRun("b", 1, "2"))
+    CmdRun("b", 1, "2", "")
+    >>> "b" in memo.runs
+    False
+    >>> memo.invalidate("x")
+    >>> memo.get("a x", lambda: CmdRun("a x", 0, "2"))
+    CmdRun("a x", 0, "2", "")
+    >>> calls = []
+    >>> def slow():
+    ...     calls.append(1)
+    ...     time.sleep(0.1)
+    ...     return CmdRun("c", 0, "3")
+    >>> threads = [threading.Thread(target=memo.get, args=("c", slow)) for _ in "abc"]
+    >>> for t in threads: t.start()
+    >>> for t in threads: t.join()
+    >>> len(calls)
+    1
+    """
+
+    runs: Dict[str, CmdRun]
+    in_flight: Dict[str, Flight]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.in_flight = {}
+
+    def get(self, cmd: str, execute: Callable[[], CmdRun]) -> CmdRun:
+        while True:
+            with self.lock:
+                if cmd in self.runs:
+                    return self.runs[cmd]
+                leader = cmd not in self.in_flight
+                if leader:
+                    self.in_flight[cmd] = Flight()
+                flight = self.in_flight[cmd]
+            if not leader:
+                flight.event.wait()
+                if flight.run is not None:
+                    return flight.run
+                continue  # leader failed with exception, try again
+            try:
+                flight.run = execute()
+            finally:
+                with self.lock:
+                    del self.in_flight[cmd]
+                    if flight.run is not None and flight.run.rc == 0:
+                        if not flight.stale:
+                            self.runs[cmd] = flight.run
+                flight.event.set()
+            return flight.run
+
+    def put(self, cmd: str, run: CmdRun):
+        """
+        Output of `cmd` obtained some other way, i.e. from batch request
+        """
+        with self.lock:
+            self.runs[cmd] = run
+
+    def invalidate(self, *words: str):
+        """
+        Forgets commands that have all of `words` in them, including ones
+        still in flight
+        """
+        with self.lock:
+            for cmd in list(self.runs):
+                if set(words) <= set(cmd.split()):
+                    del self.runs[cmd]
+            for cmd, flight in self.in_flight.items():
+                if set(words) <= set(cmd.split()):
+                    flight.stale = True
+
+    def clear(self):
+        with self.lock:
+            self.runs.clear()
+            for flight in self.in_flight.values():
+                flight.stale = True
 
 
 class Cmd:
@@ -168,16 +795,84 @@ class Cmd:
     record_to: Recorder
     replay_from: Player
     override_utcnow: datetime
+    memo: Memo
+    shared: Memo
+    rate: RateControl
+    deadline: Optional[float]
+    timeouts: Dict[str, float]
+    arm_batch: bool
+    graph: bool
+    rest: Optional[RestClient]
+    log_prefix: str
 
     def __init__(
         self,
         record_to: Recorder = None,
         replay_from: Player = None,
         now: datetime = None,
+        shared: Memo = None,
+        rate: RateControl = None,
+        log_prefix: str = "",
     ):
         self.record_to = record_to
         self.replay_from = replay_from
         self.override_utcnow = now
+        self.memo = Memo()
+        self.shared = Memo() if shared is None else shared
+        self.rate = RateControl() if rate is None else rate
+        self.deadline = None
+        self.timeouts = dict(TIMEOUTS)
+        self.arm_batch = False
+        self.graph = False
+        self.rest = None
+        self.log_prefix = log_prefix
+
+    def apply_options(self, options: Dict[str, Any]):
+        """
+        `-deadline:30m` to limit whole action and `-timeouts:read=2m,create=1h`
+        to override `TIMEOUTS`
+        """
+        if "deadline" in options and self.deadline is None:
+            seconds = to_timedelta(options["deadline"]).total_seconds()
+            self.deadline = time.monotonic() + seconds
+        if "timeouts" in options:
+            self.timeouts.update(parse_timeouts(options["timeouts"]))
+        self.arm_batch = self.arm_batch or "arm_batch" in options
+        self.graph = self.graph or "graph" in options
+        if "rest" in options and self.rest is None:
+            self.rest = RestClient(TokenCache(self.fetch_token))
+
+    def timeout_for(self, cmd: str) -> float:
+        """
+        Timeout of command family, cut to time left before deadline
+        """
+        timeout = self.timeouts.get(family_of(cmd), self.timeouts["other"])
+        if self.deadline is not None:
+            left = self.deadline - time.monotonic()
+            if left <= 0:
+                raise DeadlineExceeded(f"deadline passed before: {cmd}")
+            timeout = min(timeout, left)
+        return timeout
+
+    def fork(self, log_prefix: str = "") -> "Cmd":
+        """
+        New `Cmd` for another context, that shares recorder, player and
+        read only results with this one
+        """
+        fork = type(self)(
+            record_to=self.record_to,
+            replay_from=self.replay_from,
+            now=self.override_utcnow,
+            shared=self.shared,
+            rate=self.rate,
+            log_prefix=log_prefix,
+        )
+        fork.deadline = self.deadline
+        fork.timeouts = self.timeouts
+        fork.arm_batch = self.arm_batch
+        fork.graph = self.graph
+        fork.rest = self.rest
+        return fork
 
     def q(
         self,
@@ -185,27 +880,143 @@ class Cmd:
         print_out=False,
         show_err: bool = True,
         only_errors: bool = False,
+        memo: bool = False,
+        shared: bool = False,
+        native: Callable[[float], Any] = None,
     ):
-        def log(text):
-            print_err(self.ctx.secrets.hide(text))
-
+        """
+        :param memo: reuse output of the same command within this run, until
+            it is invalidated by a mutating command
+        :param shared: reuse output of the same command for all contexts in
+            this process, for data that never changes
+        :param native: with `-rest`, called with timeout instead of running
+            `cmd`, returns the same json as `cmd` would output
+        """
         if only_errors:
             cmd = cmd + " --only-show-errors"
-        if self.replay_from is None:
-            self.run = CmdRun(cmd, log=log)
+        if shared:
+            self.run = self.shared.get(cmd, lambda: self.execute(cmd, native))
+        elif memo:
+            self.run = self.memo.get(cmd, lambda: self.execute(cmd, native))
         else:
-            self.run = self.replay_from.get(cmd)
-            log(f"fake: {cmd}")
-        if self.record_to is not None:
-            self.record_to.record(self.run)
+            self.run = self.execute(cmd, native)
         if print_out:
             print_err(self.run.out)
-        if show_err and self.run.err:
-            print_err(self.run.err)
-        if self.run.rc != 0:
-            raise ValueError(f"rc:{self.run.rc}")
+        self.check(self.run, show_err)
         return self
 
+    def q_items(self, cmd: str, only_errors: bool = False) -> Iterator[Any]:
+        """
+        Runs command that outputs json array and yields its elements as they
+        are decoded from stdout. Whole output is still captured when commands
+        are recorded or replayed.
+        """
+        if self.replay_from is not None or self.record_to is not None:
+            yield from iter_json_array([self.q(cmd, only_errors=only_errors).text()])
+            return
+        if only_errors:
+            cmd = cmd + " --only-show-errors"
+        service = service_of(cmd)
+        attempt = 0
+        while True:
+            # slot is held until listing is consumed, consumers run no other
+            # commands while iterating
+            with self.rate.slot(service, self.deadline):
+                run = CmdRun(
+                    cmd, log=self.log, stream=True, timeout=self.timeout_for(cmd)
+                )
+                chunks = run.iter_out()
+                yielded = False
+                try:
+                    for item in iter_json_array(chunks):
+                        yielded = True
+                        yield item
+                except ValueError:
+                    for _ in chunks:  # process failure more relevant than bad json
+                        pass
+                    self.rate.observe(service, classify(run))
+                    if yielded or not self.rate.should_retry(cmd, run, attempt):
+                        self.check(run)
+                        raise
+                else:
+                    for _ in chunks:  # drain trailing whitespace and wait for exit
+                        pass
+                    self.rate.observe(service, classify(run))
+                    self.check(run)
+                    return
+                finally:
+                    if run.rc is None and run.process is not None:
+                        # consumer stopped early
+                        run.stop_killer()
+                        kill_group(run.process)
+                        run.process.wait()
+            self.retry_pause(cmd, run, attempt)
+            attempt += 1
+
+    def execute(self, cmd: str, native: Callable[[float], Any] = None) -> CmdRun:
+        """
+        Runs (or replays) command within rate window of its service, and
+        retries throttled commands and transient failures of read commands
+        """
+        service = service_of(cmd)
+        attempt = 0
+        while True:
+            with self.rate.slot(service, self.deadline):
+                if self.replay_from is not None:
+                    run = self.replay_from.get(cmd)
+                    self.log(f"fake: {cmd}")
+                else:
+                    start = time.monotonic()
+                    if native is not None and self.rest is not None:
+                        run = self.run_native(cmd, native)
+                    else:
+                        run = CmdRun(cmd, log=self.log, timeout=self.timeout_for(cmd))
+                    run.elapsed = time.monotonic() - start
+            if self.record_to is not None:
+                self.record_to.record(run)
+            self.rate.observe(service, classify(run))
+            if not self.rate.should_retry(cmd, run, attempt):
+                return run
+            self.retry_pause(cmd, run, attempt)
+            attempt += 1
+
+    def run_native(self, cmd: str, native: Callable[[float], Any]) -> CmdRun:
+        """
+        Result of `native` as if `cmd` was run, so it is memoized, recorded
+        and retried the same way
+        """
+        self.log(f"rest: {cmd}")
+        try:
+            return CmdRun(cmd, 0, json.dumps(native(self.timeout_for(cmd))))
+        except RestError as e:
+            return CmdRun(cmd, 3 if e.status == 404 else 1, err=e.az_err())
+        except (OSError, http.client.HTTPException) as e:
+            return CmdRun(cmd, 1, err=f"ERROR: Connection error: {e!r}")
+
+    def fetch_token(self, resource: str) -> Tuple[str, float]:
+        token = self.q(f"az account get-access-token --resource {resource}").json(
+            lambda json: [("hidden_token", json["accessToken"])]
+        )
+        return token["accessToken"], token_expiry(token)
+
+    def retry_pause(self, cmd: str, run: CmdRun, attempt: int):
+        delay = self.rate.backoff(attempt, retry_after(run))
+        self.log(f"{classify(run)}, retry in {delay:.1f}s: {cmd}")
+        self.sleep(delay)
+
+    def log(self, text):
+        print_err(self.log_prefix + self.ctx.secrets.hide(text))
+
+    def check(self, run: CmdRun, show_err: bool = True):
+        if show_err and run.err:
+            print_err(run.err)
+        if run.rc != 0:
+            raise ValueError(f"rc:{run.rc}")
+
+    def sleep(self, seconds: float):
+        if self.replay_from is None:
+            time.sleep(seconds)
+
     def utcnow(self):
         if self.override_utcnow:
             return self.override_utcnow
@@ -226,9 +1037,155 @@ class Cmd:
         return self.run.out
 
 
+WEB_API_VERSION = "2022-03-01"
+ACR_API_VERSION = "2019-05-01"
+STORAGE_API_VERSION = "2021-09-01"
+COSMOS_API_VERSION = "2021-10-15"
+ARM = "https://management.azure.com"
+ARM_BATCH_API_VERSION = "2020-06-01"
+ARM_BATCH_LIMIT = 20  # requests in one ARM batch
+GRAPH_API_VERSION = "2021-03-01"
+GRAPH_PAGE_SIZE = 1000
+# resource type in Resource Graph -> key in `AzCmd.get_inventory()`
+GRAPH_TYPES = {
+    "microsoft.containerregistry/registries": "acrs",
+    "microsoft.documentdb/databaseaccounts": "mongos",
+    "microsoft.storage/storageaccounts": "storages",
+    "microsoft.web/serverfarms": "plans",
+    "microsoft.web/sites": "webapps",
+}
+
+
+def compact_json(o: Any) -> str:
+    """
+    Json without whitespace, to be passed as single word of command line
+
+    >>> print(compact_json({"q": "a | b", "n": [1, 2]}))
+    {"q":"a\\u0020|\\u0020b","n":[1,2]}
+    """
+    return json.dumps(o, separators=(",", ":")).replace(" ", "\\u0020")
+
+
+def projection(*fields: str, where: str = "", many: bool = True) -> str:
+    """
+    JMESPath for `--query` that keeps only dotted `fields` of every element
+    of array (or of single object when not `many`), in same nested shape.
+    No whitespace, so it stays single word of command line
+
+    >>> projection("name", "sku.name", "sku.tier", "kind")
+    '[].{name:name,sku:{name:sku.name,tier:sku.tier},kind:kind}'
+    >>> projection("name", where="resourceGroup=='g'")
+    "[?resourceGroup=='g'].{name:name}"
+    >>> projection("name", "id", many=False)
+    '{name:name,id:id}'
+    """
+
+    def multiselect(paths: List[List[str]], prefix: List[str]) -> str:
+        groups: Dict[str, List[List[str]]] = {}
+        for path in paths:
+            groups.setdefault(path[0], []).append(path[1:])
+        return (
+            "{"
+            + ",".join(
+                (
+                    f"{k}:{'.'.join(prefix + [k])}"
+                    if not all(tails)
+                    else f"{k}:{multiselect(tails, prefix + [k])}"
+                )
+                for k, tails in groups.items()
+            )
+            + "}"
+        )
+
+    selected = multiselect([f.split(".") for f in fields], [])
+    if not many:
+        return selected
+    selector = f"[?{where}]" if where else "[]"
+    return f"{selector}.{selected}"
+
+
+# `--query` projections: only fields that loaders read
+NAMES_QUERY = projection("name")
+WEBAPP_FIELDS = (
+    "name",
+    "state",
+    "siteConfig.linuxFxVersion",
+    "appServicePlanId",
+    "lastModifiedTimeUtc",
+    "tags",
+)
+PLAN_FIELDS = ("name", "sku.name", "kind", "location", "resourceGroup")
+STORAGE_QUERY = projection("name", "accessTier")
+SHARE_QUERY = projection("name", "properties.quota")
+MANIFEST_QUERY = projection("digest", "timestamp", "tags")
+LOCATION_QUERY = projection("name", "displayName")
+
+
+def from_graph(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Resource Graph row in shape of `az ... list` output, with only fields
+    that loaders use
+
+    >>> from_graph({"type": "microsoft.web/serverfarms", "name": "p",
+    ...     "kind": "linux", "location": "eastus", "resourceGroup": "g",
+    ...     "sku": {"name": "B1", "tier": "Basic"}, "properties": {}})
+    {'name': 'p', 'kind': 'linux', 'location': 'eastus', 'resourceGroup': 'g', 'sku': {'name': 'B1'}}
+    >>> site = from_graph({"type": "microsoft.web/sites", "name": "s",
+    ...     "properties": {"state": "Running", "serverFarmId": "/x/p",
+    ...         "lastModifiedTimeUtc": "2022-01-01T00:00:00",
+    ...         "siteProperties": {"properties": [
+    ...             {"name": "LinuxFxVersion", "value": "DOCKER|x/y:1"}]}}})
+    >>> site["appServicePlanId"], site["siteConfig"]
+    ('/x/p', {'linuxFxVersion': 'DOCKER|x/y:1'})
+    """
+    kind = GRAPH_TYPES[row["type"]]
+    props = row.get("properties") or {}
+    d: Dict[str, Any] = {"name": row["name"]}
+    if kind == "storages":
+        d["accessTier"] = props.get("accessTier")
+    elif kind == "plans":
+        d["kind"] = row["kind"]
+        d["location"] = row["location"]
+        d["resourceGroup"] = row["resourceGroup"]
+        d["sku"] = {"name": row["sku"]["name"]}
+    elif kind == "webapps":
+        site_props = (props.get("siteProperties") or {}).get("properties") or []
+        fx = {p["name"]: p["value"] for p in site_props}.get("LinuxFxVersion")
+        d["state"] = props["state"]
+        d["appServicePlanId"] = props["serverFarmId"]
+        d["lastModifiedTimeUtc"] = props.get("lastModifiedTimeUtc")
+        d["siteConfig"] = {"linuxFxVersion": fx}
+        d["tags"] = row.get("tags") or {}
+    return d
+
+
+def from_arm(resource: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ARM resource in shape of `az ... list` output, see `from_graph`
+
+    >>> from_arm({"id": "/subscriptions/s/resourceGroups/g/providers/x",
+    ...     "type": "Microsoft.Storage/storageAccounts", "name": "st",
+    ...     "properties": {"accessTier": "Hot"}})
+    {'name': 'st', 'accessTier': 'Hot'}
+    """
+    group = resource["id"].split("/")[4]
+    row = {**resource, "type": resource["type"].lower(), "resourceGroup": group}
+    return from_graph(row)
+
+
+def cli_list(props: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    `properties` of ARM `.../config/{appsettings,azurestorageaccounts}/list`
+    in shape of `az webapp config ... list` output
+    """
+    return [{"name": k, "value": v, "slotSetting": False} for k, v in props.items()]
+
+
 class AzCmd(Cmd):
     def get_location_mapping(self) -> Dict[str, str]:
-        all_locations = self.q(f"az account list-locations").json()
+        all_locations = self.q(
+            f"az account list-locations --query {LOCATION_QUERY}", shared=True
+        ).json()
         m = {}
         for l in all_locations:
             name = l["name"]
@@ -236,97 +1193,348 @@ class AzCmd(Cmd):
             m[name] = name
         return m
 
+    def invalidate(self, *words: str):
+        self.memo.invalidate(*words)
+        # Resource Graph catches up with changes only after a while
+        self.graph = False
+
+    def arm_list(self, path: str, api_version: str, timeout: float) -> List[Any]:
+        assert self.rest is not None
+        return self.rest.arm_list(path, api_version, timeout)
+
+    def arm_resources(
+        self, resource_type: str, api_version: str
+    ) -> Callable[[float], List[Dict[str, Any]]]:
+        """
+        `native` read of resources of `resource_type` in group, for `-rest`
+        """
+        return lambda timeout: [
+            from_arm(r)
+            for r in self.arm_list(
+                f"{self.group_uri()}/providers/{resource_type}", api_version, timeout
+            )
+        ]
+
+    def site_config_list(
+        self, name: str, config: str
+    ) -> Callable[[float], List[Dict[str, Any]]]:
+        def read(timeout: float) -> List[Dict[str, Any]]:
+            assert self.rest is not None
+            uri = f"{self.site_uri(name)}/config/{config}/list"
+            return cli_list(
+                self.rest.arm_post(uri, WEB_API_VERSION, timeout)["properties"]
+            )
+
+        return read
+
+    def acr_read(
+        self, acr: "c.Acr", path: str, key: str = None
+    ) -> Optional[Callable[[float], Any]]:
+        """
+        `native` read of ACR data plane with admin credentials, for `-rest`.
+        With `key`, items of all pages under `key`
+        """
+        if self.rest is None:
+            return None
+        rest = self.rest
+        # before `q` of the read, that may hold the only "acr" slot
+        cred = self.get_acr_credential(acr)
+        auth = (cred["username"], cred["passwords"][acr.key_used]["value"])
+        if key is None:
+            return lambda timeout: rest.acr_get(acr.name, path, auth, timeout)
+        return lambda timeout: rest.acr_list(acr.name, path, key, auth, timeout)
+
+    def get_inventory(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Acrs, mongos, storages, plans and webapps of group from Resource
+        Graph in one query (one call per `GRAPH_PAGE_SIZE` resources), in
+        shape of corresponding `az ... list` commands.
+        """
+        config: c.WebServicesConfig = self.ctx.config
+        types = ", ".join(f"'{t}'" for t in GRAPH_TYPES)
+        query = (
+            f"Resources | where resourceGroup =~ '{config.group}' "
+            f"and type in~ ({types}) "
+            f"| project name, type, kind, location, resourceGroup, sku, tags, "
+            f"properties"
+        )
+        inventory: Dict[str, List[Dict[str, Any]]] = {
+            k: [] for k in GRAPH_TYPES.values()
+        }
+        options: Dict[str, Any] = {"$top": GRAPH_PAGE_SIZE}
+        while True:
+            body = {
+                "subscriptions": [self.get_account()["id"]],
+                "query": query,
+                "options": options,
+            }
+            page = self.q(
+                f"az rest --method post --uri {ARM}/providers/"
+                f"Microsoft.ResourceGraph/resources?api-version={GRAPH_API_VERSION} "
+                f"--body {compact_json(body)}",
+                memo=True,
+            ).json()
+            for row in page["data"]:
+                row["type"] = row["type"].lower()
+                if row["type"] in GRAPH_TYPES:
+                    inventory[GRAPH_TYPES[row["type"]]].append(from_graph(row))
+            if not page.get("$skipToken"):
+                return inventory
+            options = {**options, "$skipToken": page["$skipToken"]}
+
     def get_acr_list(self):
+        if self.graph:
+            return self.get_inventory()["acrs"]
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az acr list -g {config.group}").json()
+        return self.q(
+            f"az acr list -g {config.group} --query {NAMES_QUERY}",
+            memo=True,
+            native=self.arm_resources(
+                "Microsoft.ContainerRegistry/registries", ACR_API_VERSION
+            ),
+        ).json()
 
     def get_plan_list(self):
+        if self.graph:
+            return self.get_inventory()["plans"]
         config: c.WebServicesConfig = self.ctx.config
-        plans = [
-            p
-            for p in self.q(f"az appservice plan list").json()
-            if p["resourceGroup"] == config.group
-        ]
-        return plans
+        query = projection(*PLAN_FIELDS, where=f"resourceGroup=='{config.group}'")
+        return self.q(
+            f"az appservice plan list --query {query}",
+            memo=True,
+            native=self.arm_resources("Microsoft.Web/serverfarms", WEB_API_VERSION),
+        ).json()
 
     def get_storage_list(self):
+        if self.graph:
+            return self.get_inventory()["storages"]
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az storage account list -g {config.group}").json()
+        return self.q(
+            f"az storage account list -g {config.group} --query {STORAGE_QUERY}",
+            memo=True,
+            native=self.arm_resources(
+                "Microsoft.Storage/storageAccounts", STORAGE_API_VERSION
+            ),
+        ).json()
 
     def get_acr_repo_list(self, acr: "c.Acr"):
-        return self.q(f"az acr repository list -n {acr.name}").json()
+        return self.q(
+            f"az acr repository list -n {acr.name}",
+            memo=True,
+            native=self.acr_read(acr, "/acr/v1/_catalog", "repositories"),
+        ).json()
+
+    def show_acr_repo(self, repo: "c.Repository", acr: "c.Acr"):
+        return self.q(
+            f"az acr repository show -n {acr.name} --repository {repo.name}",
+            memo=True,
+            native=self.acr_read(acr, f"/acr/v1/{repo.name}"),
+        ).json()
 
     def get_acr_credential(self, acr: "c.Acr"):
-        return self.q(f"az acr credential show -n {acr.name}").json(
+        return self.q(f"az acr credential show -n {acr.name}", shared=True).json(
             lambda json: (("hidden_acr_pwd", pwd["value"]) for pwd in json["passwords"])
         )
 
     def show_manifests(self, repo: "c.Repository", acr: "c.Acr" = None):
         if acr is None:
             acr = repo.path.parent(2).get_state()
-        return self.q(
+        cmd = (
             f"az acr repository show-manifests -n {acr.name}"
-            f" --repository {repo.name}"
-        ).json()
+            f" --repository {repo.name} --query {MANIFEST_QUERY}"
+        )
+        if self.rest is None:
+            return self.q_items(cmd)
+        read = self.acr_read(acr, f"/acr/v1/{repo.name}/_manifests", "manifests")
+        return iter(
+            self.q(
+                cmd,
+                native=lambda timeout: [
+                    {
+                        "digest": m["digest"],
+                        "timestamp": m["lastUpdateTime"],
+                        "tags": m.get("tags") or [],
+                    }
+                    for m in read(timeout)
+                ],
+            ).json()
+        )
 
     def list_storage_keys(self, storage: "c.Storage"):
         config: c.WebServicesConfig = self.ctx.config
         return self.q(
-            f"az storage account keys list -g {config.group}" f" -n {storage.name}"
+            f"az storage account keys list -g {config.group}" f" -n {storage.name}",
+            memo=True,
         ).json(lambda json: (("hidden_storage_key", pwd["value"]) for pwd in json))
 
     def list_file_shares(self, storage: "c.Storage"):
         return self.q(
-            f"az storage share list --account-name {storage.name} ", only_errors=True
+            f"az storage share list --account-name {storage.name} "
+            f"--query {SHARE_QUERY}",
+            only_errors=True,
+            memo=True,
+            native=lambda timeout: [
+                {
+                    "name": d["name"],
+                    "properties": {"quota": d["properties"]["shareQuota"]},
+                }
+                for d in self.arm_list(
+                    f"{self.group_uri()}/providers/Microsoft.Storage/storageAccounts"
+                    f"/{storage.name}/fileServices/default/shares",
+                    STORAGE_API_VERSION,
+                    timeout,
+                )
+            ],
         ).json()
 
     def list_services(self):
+        if self.graph:
+            return iter(self.get_inventory()["webapps"])
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az webapp list --resource-group {config.group}").json()
+        cmd = (
+            f"az webapp list --resource-group {config.group} "
+            f"--query {projection(*WEBAPP_FIELDS)}"
+        )
+        if self.rest is None:
+            return self.q_items(cmd)
+        native = self.arm_resources("Microsoft.Web/sites", WEB_API_VERSION)
+        return iter(self.q(cmd, native=native).json())
 
     def list_webapp_shares(self, service: "c.Service"):
-        config: c.WebServicesConfig = self.ctx.config
         return self.q(
-            f"az webapp config storage-account list "
-            f"--resource-group {config.group} --name {service.name}",
-            only_errors=True,
+            self.webapp_shares_cmd(service.name),
+            memo=True,
+            native=self.site_config_list(service.name, "azurestorageaccounts"),
         ).json()
 
+    def webapp_shares_cmd(self, name: str) -> str:
+        config: c.WebServicesConfig = self.ctx.config
+        return (
+            f"az webapp config storage-account list "
+            f"--resource-group {config.group} --name {name} --only-show-errors"
+        )
+
+    def prefetch_webapps(self, names: List[str]):
+        """
+        With `-arm_batch`, reads app settings and mounts of webapps `names`
+        in ARM batch requests and puts them into memo as outputs of
+        `get_app_settings` and `list_webapp_shares`, converted to shape of
+        `az` output. Failed responses are left for those to read one by one.
+        """
+        if not self.arm_batch:
+            return
+        requests = [
+            (list_cmd, f"{self.site_uri(name)}/config/{config}/list")
+            for name in names
+            for list_cmd, config in (
+                (self.app_settings_cmd(name), "appsettings"),
+                (self.webapp_shares_cmd(name), "azurestorageaccounts"),
+            )
+        ]
+        for start in range(0, len(requests), ARM_BATCH_LIMIT):
+            chunk = requests[start : start + ARM_BATCH_LIMIT]
+            body = {
+                "requests": [
+                    {
+                        "name": str(i),
+                        "httpMethod": "POST",
+                        "url": f"{uri}?api-version={WEB_API_VERSION}",
+                    }
+                    for i, (_, uri) in enumerate(chunk)
+                ]
+            }
+            responses = self.q(
+                f"az rest --method post "
+                f"--uri {ARM}/batch?api-version={ARM_BATCH_API_VERSION} "
+                f"--body {compact_json(body)}",
+                only_errors=True,
+            ).json()["responses"]
+            for r in responses:
+                list_cmd, _ = chunk[int(r["name"])]
+                if r.get("httpStatusCode") != 200:
+                    continue
+                out = cli_list(r["content"]["properties"])
+                self.memo.put(list_cmd, CmdRun(list_cmd, 0, json.dumps(out), ""))
+
     def delete_acr_image(self, iv: "c.ImageVer"):
         repo: c.Repository = iv.repo_path.get_config()
         acr: c.Acr = iv.repo_path.parent(2).get_config()
-        return self.q(
+        out = self.q(
             f"az acr repository delete --yes -n {acr.name} "
             f"--image {repo.name}@{iv.digest}",
             only_errors=True,
         ).text()
+        self.invalidate(acr.name, repo.name)
+        return out
+
+    def exists(self, cmd: str) -> bool:
+        """
+        Whether `show` command finds resource, without reading it whole
+        """
+        run = self.execute(f"{cmd} --query id")
+        if run.rc != 0 and NOT_FOUND_RE.search(run.err):
+            return False
+        self.check(run)
+        return run.out.strip() not in ("", "null")
+
+    def webapp_exists(self, name: str) -> bool:
+        config: c.WebServicesConfig = self.ctx.config
+        return self.exists(f"az webapp show -n {name} -g {config.group}")
+
+    def app_plan_exists(self, name: str) -> bool:
+        config: c.WebServicesConfig = self.ctx.config
+        return self.exists(f"az appservice plan show -n {name} -g {config.group}")
 
     def delete_webapp(self, service: "c.Service"):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(
+        out = self.q(
             f"az webapp delete -n {service.name} -g {config.group} --keep-empty-plan"
         ).text()
+        self.invalidate("webapp", service.name)
+        return out
 
     def delete_app_plan(self, plan: "c.AppServicePlanState"):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(
+        out = self.q(
             f"az appservice plan delete -y -n {plan.name} -g {config.group} "
         ).text()
+        self.invalidate("appservice", "plan", "list")
+        return out
 
     def create_app_plan(self, plan: "c.AppServicePlan"):
         state: c.WebServicesState = self.ctx.state
         kind_opt = educated_guess(
             plan.kind, {"--is-linux": [], "": ["app"], "--hyper-v": []}
         )
-        return self.q(
+        out = self.q(
             f"az appservice plan create -n {plan.name} -g {state.group} --sku {plan.sku} -l {state.location_id(plan.location)} {kind_opt} "
-        ).text()
+        ).json()
+        self.invalidate("appservice", "plan", "list")
+        return out
+
+    def show_app_plan(self, name: str, plan_id: str = None) -> Dict[str, Any]:
+        config: c.WebServicesConfig = self.ctx.config
+        target = f"--ids {plan_id}" if plan_id else f"-n {name} -g {config.group}"
+        query = projection(*PLAN_FIELDS, many=False)
+        return self.q(f"az appservice plan show {target} --query {query}").json()
+
+    def show_webapps(self, ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Webapps by ids, in shape of `list_services` items
+        """
+        if not ids:
+            return []
+        query = projection(*WEBAPP_FIELDS, many=len(ids) > 1)
+        out = self.q(f"az webapp show --ids {' '.join(ids)} --query {query}").json()
+        return out if isinstance(out, list) else [out]
 
     def update_app_plan_sku(self, plan: "c.AppServicePlan"):
         state: c.WebServicesState = self.ctx.state
-        return self.q(
+        out = self.q(
             f"az appservice plan update -n {plan.name} -g {state.group} --sku {plan.sku}"
         ).text()
+        self.invalidate("appservice", "plan", "list")
+        return out
 
     def create_webapp(self, service: "c.Service"):
         config: c.WebServicesConfig = self.ctx.config
@@ -339,16 +1547,69 @@ class AzCmd(Cmd):
             acr: c.AcrState = self.ctx.state.acrs[service.container.acr]  # type:ignore
             append = f" -s {acr.get_credentials()[0]} -w {acr.get_credentials()[1]}"
 
-        return self.q(
+        out = self.q(
             f"az webapp create -n {service.name} -g {config.group} "
             f"-p {plan.name} -i {service.docker_url()}{append}",
             only_errors=True,
         ).json()
+        self.invalidate("webapp", service.name)
+        return out
+
+    def tag_webapp(self, service: "c.Service", tags: Dict[str, str]):
+        config: c.WebServicesConfig = self.ctx.config
+        sets = " ".join(f"--set tags.{k}={v}" for k, v in tags.items())
+        out = self.q(
+            f"az webapp update -n {service.name} -g {config.group} {sets}",
+            only_errors=True,
+        ).json()
+        self.invalidate("webapp", service.name)
+        return out
+
+    def mount_shares(self, service: "c.Service", mounts: List["c.Mount"]):
+        """
+        Adds all `mounts` to freshly created webapp in one call. Replaces
+        mounts that webapp already has.
+        """
+        if len(mounts) == 1:
+            return self.mount_share(mounts[0])
+        config: c.WebServicesConfig = self.ctx.config
+        body = {
+            "properties": {
+                mount.default_custom_id(): {
+                    "type": "AzureFiles",
+                    "accountName": mount.account,
+                    "shareName": mount.share,
+                    "accessKey": mount.access_key(),
+                    "mountPath": mount.name,
+                }
+                for mount in mounts
+            }
+        }
+        out = self.q(
+            f"az rest --method put --uri {self.webapp_uri(service)}"
+            f"/config/azurestorageaccounts?api-version={WEB_API_VERSION} "
+            f"--body {compact_json(body)}",
+            only_errors=True,
+        ).json()
+        self.invalidate("storage-account", service.name)
+        return out
+
+    def webapp_uri(self, service: "c.Service") -> str:
+        return self.site_uri(service.name)
+
+    def site_uri(self, name: str) -> str:
+        return f"{self.group_uri()}/providers/Microsoft.Web/sites/{name}"
+
+    def group_uri(self) -> str:
+        config: c.WebServicesConfig = self.ctx.config
+        return (
+            f"/subscriptions/{self.get_account()['id']}/resourceGroups/{config.group}"
+        )
 
     def mount_share(self, mount: "c.Mount"):
         config: c.WebServicesConfig = self.ctx.config
         service: c.Service = mount.path.parent(2).get_config()
-        return self.q(
+        out = self.q(
             f"az webapp config storage-account add "
             f"--resource-group {config.group} --name {service.name} "
             f"--custom-id {mount.default_custom_id()} "
@@ -357,21 +1618,34 @@ class AzCmd(Cmd):
             f"--access-key {mount.access_key()} --mount-path {mount.name}",
             only_errors=True,
         ).json()
+        self.invalidate("storage-account", service.name)
+        return out
 
     def list_cosmos_dbs(self):
+        if self.graph:
+            return self.get_inventory()["mongos"]
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az cosmosdb list -g {config.group}").json()
+        return self.q(
+            f"az cosmosdb list -g {config.group} --query {NAMES_QUERY}",
+            memo=True,
+            native=self.arm_resources(
+                "Microsoft.DocumentDB/databaseAccounts", COSMOS_API_VERSION
+            ),
+        ).json()
 
     def create_mongo_db(self, mongo: "c.MongoDb"):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(
+        out = self.q(
             f"az cosmosdb create -n {mongo.name} -g {config.group} --kind MongoDB"
         ).json()
+        self.invalidate("cosmosdb", "list")
+        return out
 
     def get_mongo_connections(self, mongo: "c.MongoDb"):
         config: c.WebServicesConfig = self.ctx.config
         json = self.q(
-            f"az cosmosdb keys list --type connection-strings -n {mongo.name} -g {config.group}"
+            f"az cosmosdb keys list --type connection-strings -n {mongo.name} -g {config.group}",
+            memo=True,
         ).json(
             lambda json: (
                 ("hidden_connection_string", c["connectionString"])
@@ -381,41 +1655,52 @@ class AzCmd(Cmd):
 
         return json
 
-    def set_app_settings(self, app: "c.Service", k: str, v: str):
+    def set_app_settings(self, app: "c.Service", settings: Dict[str, str]):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(
+        pairs = " ".join(f"{k}={v}" for k, v in settings.items())
+        out = self.q(
             f"az webapp config appsettings set -n {app.name} -g {config.group} "
-            f"--settings {k}={v}"
+            f"--settings {pairs}"
         ).json()
+        self.invalidate("appsettings", app.name)
+        return out
 
     def get_app_settings(self, app: "c.ServiceState"):
-        config: c.WebServicesConfig = self.ctx.config
         return self.q(
-            f"az webapp config appsettings list -n {app.name} -g {config.group}"
+            self.app_settings_cmd(app.name),
+            memo=True,
+            native=self.site_config_list(app.name, "appsettings"),
         ).json()
 
+    def app_settings_cmd(self, name: str) -> str:
+        config: c.WebServicesConfig = self.ctx.config
+        return f"az webapp config appsettings list -n {name} -g {config.group}"
+
     # az webapp config storage-account list --resource-group {config.group} --name {ss.name}
     # az webapp config storage-account delete --custom-id {sharec.custom_id} --resource-group {config.group} --name {ss.name}
 
     def get_service_props(self, ss: "c.ServiceState"):
         config: c.WebServicesConfig = self.ctx.config
         return self.q(
-            f"az webapp config container show -n {ss.name} -g {config.group}"
+            f"az webapp config container show -n {ss.name} -g {config.group}",
+            memo=True,
         ).json()
 
     def update_webapp_docker(self, ss: "c.ServiceState"):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(
+        out = self.q(
             f"az webapp config container set -n {ss.name} "
             f"-g {config.group} -c {ss.docker}"
         ).json()
+        self.invalidate("webapp", ss.name)
+        return out
 
     def restart_webapp(self, ss: "c.Service"):
         config: c.WebServicesConfig = self.ctx.config
         return self.q(f"az webapp restart -n {ss.name} -g {config.group}").text()
 
     def get_account(self):
-        return self.q(f"az account show").json()
+        return self.q(f"az account show", shared=True).json()
 
 
 import azup.context as c
@@ -1,11 +1,27 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
 import typing
 from datetime import datetime, timedelta
-
-from dateutil.parser import parse as dt_parse
+from pathlib import Path
 
 import azup
 
 ACR_SUFFIX = ".azurecr.io"
+# webapp tag with `Service.fingerprint` of config it was created from
+FINGERPRINT_TAG = "azup_fp"
+
+CACHE_DIR = Path(os.environ.get("AZUP_CACHE", Path.home() / ".cache" / "azup"))
+
+
+# `Context` that unpickled paths are bound to, see `CompiledConfigCache`
+_unpickling = threading.local()
+
+
+def _rebind_path(*parts: str) -> "CtxPath":
+    return CtxPath(_unpickling.ctx, *parts)
 
 
 class CtxPath:
@@ -16,6 +32,9 @@ class CtxPath:
         self.ctx = ctx
         self.parts = tuple(parts)
 
+    def __reduce__(self):
+        return _rebind_path, self.parts
+
     def parent(self, generation=1) -> "CtxPath":
         return CtxPath(self.ctx, *self.parts[:-generation])
 
@@ -93,6 +112,43 @@ def to__str__(that):
     return to_dict(that, YAMLABLE_OBJECTS)
 
 
+class LazyAttr:
+    """
+    Attribute loaded by decorated method on first access, and then stored
+    in instance like any other attribute, so it can be assigned too.
+    State subtrees use it to make only `az` calls action needs.
+
+    >>> class X:
+    ...     @LazyAttr
+    ...     def y(self):
+    ...         print("loading")
+    ...         return 5
+    >>> x = X()
+    >>> x.y
+    loading
+    5
+    >>> x.y
+    5
+    >>> "y" in vars(X())
+    False
+    """
+
+    def __init__(self, loader: typing.Callable[[typing.Any], typing.Any]):
+        self.loader = loader
+        self.name = loader.__name__
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = self.loader(obj)
+        obj.__dict__[self.name] = value
+        return value
+
+
+def is_loaded(o: typing.Any, attr: str) -> bool:
+    return attr in vars(o)
+
+
 class ContextAware:
     path: CtxPath
 
@@ -138,7 +194,7 @@ class ImageVer:
     def __init__(self, repo_path: CtxPath, d: typing.Dict[str, typing.Any]):
         self.repo_path = repo_path
         self.digest = d["digest"]
-        self.timestamp = dt_parse(d["timestamp"]).replace(tzinfo=None)
+        self.timestamp = azup.dt_iso_parse(d["timestamp"])
         self.labels = []
         self.tags = set()
         self.git = None
@@ -161,6 +217,16 @@ class ImageVer:
     def __repr__(self):
         return str(self)
 
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "digest": self.digest,
+            "timestamp": self.timestamp.isoformat(),
+            "git": self.git,
+            "labels": self.labels,
+            "purge": PURGE in self.tags,
+            "in_use": IN_USE in self.tags,
+        }
+
     def set_tag(self, tag: str, sw: bool):
         if sw:
             self.tags.add(tag)
@@ -181,6 +247,15 @@ class Repository(ContextAware):
 class RepositoryState(Repository):
     vers: typing.List[ImageVer]
     by_tag: typing.Dict[str, ImageVer]
+    last_update: str = None
+
+    @LazyAttr  # type:ignore
+    def vers(self):
+        return self.load(self.path.parent(2).get_state()).vers
+
+    @LazyAttr  # type:ignore
+    def by_tag(self):
+        return self.load(self.path.parent(2).get_state()).by_tag
 
     def load(self, acr: "AcrState"):
         az_cmd = self.path.ctx.az_cmd
@@ -192,6 +267,15 @@ class RepositoryState(Repository):
         self.by_tag = {k: iv for iv in self.vers for k in iv.all_ids()}
         return self
 
+    def refresh(self, acr: "AcrState"):
+        az_cmd = self.path.ctx.az_cmd
+        last_update = az_cmd.show_acr_repo(self, acr)["lastUpdateTime"]
+        if last_update != self.last_update:
+            if is_loaded(self, "vers"):  # otherwise loaded when used
+                self.load(acr)
+            self.last_update = last_update
+        return self
+
     def to_remove(self) -> typing.List[ImageVer]:
         ctx = self.path.ctx
         now = ctx.az_cmd.utcnow()
@@ -223,11 +307,16 @@ class AcrState(Acr):
         az_cmd = self.path.ctx.az_cmd
         self.name = self.path.key()
         self.repos = {
-            n: RepositoryState.build(self, "repos", n).load(self)
+            n: RepositoryState.build(self, "repos", n).set(name=n)
             for n in az_cmd.get_acr_repo_list(self)
         }
         return self
 
+    def refresh(self, repo_names: typing.Iterable[str]):
+        for n in repo_names:
+            if n in self.repos:
+                self.repos[n].refresh(self)  # type:ignore
+
     def get_credentials(self) -> typing.Tuple[str, str]:
         if self.credentials is None:
             az_cmd = self.path.ctx.az_cmd
@@ -265,14 +354,17 @@ class StorageState(Storage):
     keys: typing.List[str] = None
 
     def load(self, d: typing.Dict[str, typing.Any]):
-        az_cmd = self.path.ctx.az_cmd
         self.name = self.path.key()
         self.access_tier = d["accessTier"]
-        self.shares = {
+        return self
+
+    @LazyAttr
+    def shares(self):  # type:ignore
+        az_cmd = self.path.ctx.az_cmd
+        return {
             d["name"]: FileShareState.build(self, "shares", d["name"]).load(d)
             for d in az_cmd.list_file_shares(self)
         }
-        return self
 
     def get_keys(self) -> typing.List[str]:
         az_cmd = self.path.ctx.az_cmd
@@ -313,7 +405,10 @@ class Container:
 
     @classmethod
     def from_dict(cls, path: CtxPath, d: typing.Dict[str, typing.Any]) -> "Container":
-        return setattrs_from_dict(cls(), path, d)
+        o = setattrs_from_dict(cls(), path, d)
+        if o.acr is not None and not hasattr(o, "host"):
+            o.host = f"{o.acr}{ACR_SUFFIX}"  # same as parsed from state
+        return o
 
     @classmethod
     def parse(cls, docker_spec: str) -> "Container":
@@ -416,64 +511,139 @@ class Service(ContextAware):
     def docker_url(self):
         return f"{self.container.url()}@{self.resolved_tag()}"
 
-    def create(self):
+    def resolved_dict(self) -> typing.Dict[str, typing.Any]:
+        """
+        Config as dict, with tag resolved to digest when it can be
+        """
+        d = to_dict(self, YAMLABLE_OBJECTS)
+        try:
+            # `differences` may have resolved tag in place already
+            d["container"]["tag"] = self.resolved_tag()
+        except Exception:  # reported when differences are computed
+            pass
+        return d
+
+    def fingerprint(self) -> str:
+        return _digest(self.resolved_dict())
+
+    def create(self) -> typing.Optional[str]:
+        """
+        :return: id of created webapp, if `az` reported it
+        """
         az_cmd = self.path.ctx.az_cmd
-        az_cmd.create_webapp(self)
-        for mount in self.mounts.values():
-            az_cmd.mount_share(mount)
-        for conn in self.mongo_connections.values():
-            az_cmd.set_app_settings(self, conn.name, conn.access_key())
+        created = az_cmd.create_webapp(self)
+        if len(self.mounts):
+            az_cmd.mount_shares(self, list(self.mounts.values()))
+        if len(self.mongo_connections):
+            az_cmd.set_app_settings(
+                self,
+                {
+                    conn.name: conn.access_key()
+                    for conn in self.mongo_connections.values()
+                },
+            )
+        # last, so webapp is not taken as applied if anything above failed
+        az_cmd.tag_webapp(self, {FINGERPRINT_TAG: self.fingerprint()})
+        return (created or {}).get("id")
 
     def restart(self):
         self.path.ctx.az_cmd.restart_webapp(self)
 
 
-
 class ServiceState(Service):
     state: str
     docker: str
+    last_modified: str
+    applied_fingerprint: typing.Optional[str]
 
     def load(self, d: typing.Dict[str, typing.Any]):
         az_cmd = self.path.ctx.az_cmd
         self.name = self.path.key()
+        self.last_modified = d.get("lastModifiedTimeUtc")
         self.state = d["state"]
         self.docker = d["siteConfig"]["linuxFxVersion"]
         self.container = Container.parse(self.docker)
+        self.applied_fingerprint = (d.get("tags") or {}).get(FINGERPRINT_TAG)
+        return self
+
+    def fingerprint_matches(self) -> bool:
+        """
+        Webapp was created from config as it is now and still runs the same
+        image, so mounts and settings need not be read to compare
+        """
+        service: Service = self.path.get_config()
+        try:
+            return (
+                getattr(self, "applied_fingerprint", None) == service.fingerprint()
+                and self.docker == service.get_docker_spec()
+            )
+        except Exception:  # tag cannot be resolved
+            return False
+
+    @LazyAttr
+    def mounts(self):  # type:ignore
+        return self.load_sub_resources().mounts
+
+    @LazyAttr
+    def mongo_connections(self):  # type:ignore
+        return self.load_sub_resources().mongo_connections
+
+    def load_sub_resources(self):
+        az_cmd = self.path.ctx.az_cmd
+        sub_cache = self.path.ctx.sub_cache
+        cached = sub_cache.get(self.name, self.last_modified)
+        if cached is None:
+            self.path.ctx.state.prefetch_webapps(self)
+            shares = az_cmd.list_webapp_shares(self)
+            mongoStates: typing.Iterable[MongoDbState] = (
+                self.path.absolute("mongos").get_state().values()
+            )
+            db_by_cs: typing.Dict[str, typing.Tuple[str, int]] = {
+                conn_string: (db.name, i)
+                for db in mongoStates
+                for i, conn_string in enumerate(db.get_connections())
+            }
+            connections = {
+                d["name"]: db_by_cs[d["value"]]
+                for d in az_cmd.get_app_settings(self)
+                if d["value"] in db_by_cs
+            }
+            sub_cache.put(self.name, self.last_modified, shares, connections)
+        else:
+            shares, connections = cached
         self.mounts = {
             d["value"]["mountPath"]: MountState.build(
                 self, "mounts", d["value"]["mountPath"]
             ).load(d)
-            for d in az_cmd.list_webapp_shares(self)
-        }
-        mongoStates: typing.Iterable[MongoDbState] = (
-            self.path.absolute("mongos").get_state().values()
-        )
-        db_by_cs: typing.Dict[str, typing.Tuple[str, int]] = {
-            conn_string: (db.name, i)
-            for db in mongoStates
-            for i, conn_string in enumerate(db.get_connections())
+            for d in shares
         }
         self.mongo_connections = {
-            d["name"]: MongoConnectionState.build(
-                self, "mongo_connections", d["name"]
-            ).load(db_by_cs[d["value"]])
-            for d in az_cmd.get_app_settings(self)
-            if d["value"] in db_by_cs
+            name: MongoConnectionState.build(self, "mongo_connections", name).load(
+                tuple(db_conn)  # type:ignore
+            )
+            for name, db_conn in connections.items()
         }
         return self
 
-    def update(self):
+    def differences(self) -> typing.Dict[str, typing.Tuple[typing.Any, typing.Any]]:
+        """
+        :return: `{field: (in_config, in_state)}` for all fields that differ
+        """
         service: Service = self.path.get_config()
         try:
             service.container.tag = service.resolved_tag()
         except:
-            import sys
             import traceback
 
-            traceback.print_tb(sys.last_traceback)
+            traceback.print_exc()
             azup.print_err(f"Cannot resolve: {service.container}")
+        return diff_dicts(
+            to_dict(service, YAMLABLE_OBJECTS), to_dict(self, YAMLABLE_OBJECTS)
+        )
 
-        if to_yaml(service, YAMLABLE_OBJECTS) != to_yaml(self, YAMLABLE_OBJECTS):
+    def update(self):
+        service: Service = self.path.get_config()
+        if self.differences():
             self.delete()
             service.create()
             return True
@@ -491,9 +661,12 @@ class AppServicePlan(ContextAware):
     location: str
     services: typing.Dict[str, Service]
 
-    def create(self):
+    def create(self) -> typing.Optional[str]:
+        """
+        :return: id of created plan, if `az` reported it
+        """
         az_cmd = self.path.ctx.az_cmd
-        az_cmd.create_app_plan(self)
+        return (az_cmd.create_app_plan(self) or {}).get("id")
 
 
 class AppServicePlanState(AppServicePlan):
@@ -506,10 +679,17 @@ class AppServicePlanState(AppServicePlan):
         self.services = {}
         return self
 
-    def can_update(self):
+    def differences(self) -> typing.Dict[str, typing.Tuple[typing.Any, typing.Any]]:
         plan: AppServicePlan = self.path.get_config()
         plan.location = self.path.ctx.state.location_id(plan.location)
-        return all(getattr(self, n) == getattr(plan, n) for n in ("kind", "location"))
+        return {
+            n: (getattr(plan, n), getattr(self, n))
+            for n in ("kind", "location", "sku")
+            if getattr(self, n) != getattr(plan, n)
+        }
+
+    def can_update(self):
+        return not any(n in self.differences() for n in ("kind", "location"))
 
     def update(self):
         assert self.can_update()
@@ -523,6 +703,20 @@ class AppServicePlanState(AppServicePlan):
         az_cmd = self.path.ctx.az_cmd
         az_cmd.delete_app_plan(self)
 
+    def refresh_services(self, ids: typing.List[str]):
+        """
+        Rereads only webapps `ids` of this plan, i.e. just created ones,
+        and puts them into `services`
+        """
+        az_cmd = self.path.ctx.az_cmd
+        for d in az_cmd.show_webapps(ids):
+            self.services[d["name"]] = ServiceState.build(
+                self, "services", d["name"]
+            ).load(d)
+
+    def drop_service(self, name: str):
+        self.services.pop(name, None)
+
 
 # root objects
 
@@ -537,33 +731,91 @@ class WebServicesConfig(ContextAware):
 
 class WebServicesState(WebServicesConfig):
     location_mapping: typing.Dict[str, str]
+    prefetched_webapps: typing.Set[str]
 
     def location_id(self, name):
         return self.location_mapping[azup.cleanup_misc_chars(name)]
 
     def load(self):
-        az_cmd = self.path.ctx.az_cmd
+        """
+        Subtrees are loaded on first access, use `prefetch` to load them
+        up front
+        """
         config: WebServicesConfig = self.path.get_config()
         self.group = config.group
-        self.location_mapping = az_cmd.get_location_mapping()
+        self.path.ctx.sub_cache.open(self.group)
+        return self
+
+    def prefetch(self, needs: typing.Iterable[str]):
+        """
+        :param needs: dotted attribute paths, like `plans.services.mounts`,
+            dicts on the way are walked through all values
+        """
+        for need in needs:
+            objs = [self]
+            for attr in need.split("."):
+                objs = [
+                    v
+                    for o in objs
+                    for v in (
+                        getattr(o, attr).values()
+                        if isinstance(getattr(o, attr), dict)
+                        else [getattr(o, attr)]
+                    )
+                ]
+        return self
+
+    @LazyAttr  # type:ignore
+    def location_mapping(self):
+        return self.path.ctx.az_cmd.get_location_mapping()
 
-        self.acrs = {
+    @LazyAttr
+    def acrs(self):  # type:ignore
+        return {
             d["name"]: AcrState.build(self, "acrs", d["name"]).load()
-            for d in az_cmd.get_acr_list()
+            for d in self.path.ctx.az_cmd.get_acr_list()
         }
-        self.mongos = {
+
+    @LazyAttr
+    def mongos(self):  # type:ignore
+        return {
             d["name"]: MongoDbState.build(self, "mongos", d["name"]).load()
-            for d in az_cmd.list_cosmos_dbs()
+            for d in self.path.ctx.az_cmd.list_cosmos_dbs()
         }
 
-        self.storages = {
+    @LazyAttr
+    def storages(self):  # type:ignore
+        return {
             d["name"]: StorageState.build(self, "storages", d["name"]).load(d)
-            for d in az_cmd.get_storage_list()
+            for d in self.path.ctx.az_cmd.get_storage_list()
         }
+
+    @LazyAttr
+    def plans(self):  # type:ignore
         self.load_service_plans()
-        return self
+        return self.plans
+
+    def prefetch_webapps(self, service: ServiceState):
+        """
+        Lets `az_cmd` read sub-resources of `service` together with all
+        other webapps that were not loaded yet (see `-arm_batch`)
+        """
+        sub_cache = self.path.ctx.sub_cache
+        prefetched = vars(self).setdefault("prefetched_webapps", set())
+        names = [
+            s.name
+            for plan in vars(self).get("plans", {}).values()
+            for s in plan.services.values()
+            if not is_loaded(s, "mounts")
+            and s.name not in prefetched
+            and sub_cache.get(s.name, s.last_modified) is None
+        ]
+        if service.name not in prefetched and service.name not in names:
+            names.insert(0, service.name)
+        prefetched.update(names)
+        self.path.ctx.az_cmd.prefetch_webapps(names)
 
-    def load_service_plans(self):
+    def load_service_plans(self, unchanged: typing.Dict[str, ServiceState] = None):
         az_cmd = self.path.ctx.az_cmd
         self.plans = {
             d["name"]: AppServicePlanState.build(self, "plans", d["name"]).load(d)
@@ -573,7 +825,128 @@ class WebServicesState(WebServicesConfig):
             plan_name = d["appServicePlanId"].split("/")[-1]
             plan = self.plans[plan_name]
             name = d["name"]
-            plan.services[name] = ServiceState.build(plan, "services", name).load(d)
+            service = None if unchanged is None else unchanged.get(name)
+            if (
+                service is None
+                or service.last_modified != d.get("lastModifiedTimeUtc")
+                or service.path.parent(2).key() != plan_name
+            ):
+                service = ServiceState.build(plan, "services", name).load(d)
+            plan.services[name] = service
+
+    def refresh_plan(self, name: str, plan_id: str = None) -> AppServicePlanState:
+        """
+        Rereads only plan `name` after it was created or updated, by `plan_id`
+        from output of create when known. Services already in state are kept.
+        """
+        az_cmd = self.path.ctx.az_cmd
+        d = az_cmd.show_app_plan(name, plan_id)
+        plan = AppServicePlanState.build(self, "plans", name).load(d)
+        if name in self.plans:
+            plan.services = self.plans[name].services
+        self.plans[name] = plan
+        return plan
+
+    def drop_plan(self, name: str):
+        self.plans.pop(name, None)
+
+    def iter_yaml(self) -> typing.Iterator[str]:
+        """
+        Loads state section by section and yields YAML of every acr, storage,
+        mongo, plan and service as soon as it is loaded. Acrs, storages and
+        services are not kept, so memory does not grow with size of group.
+        Manifests are not read at all, since they are not part of dump.
+        """
+        az_cmd = self.path.ctx.az_cmd
+        config: WebServicesConfig = self.path.get_config()
+        self.group = config.group
+        self.path.ctx.sub_cache.open(self.group)
+        self.location_mapping = az_cmd.get_location_mapping()
+        self.acrs, self.storages, self.plans = {}, {}, {}
+        yield yaml_entry("group", self.group)
+
+        def acrs():
+            for d in az_cmd.get_acr_list():
+                acr = AcrState.build(self, "acrs", d["name"]).set(name=d["name"])
+                acr.repos = {
+                    n: RepositoryState.build(acr, "repos", n).set(name=n)
+                    for n in az_cmd.get_acr_repo_list(acr)
+                }
+                yield acr.name, to_dict(acr, YAMLABLE_OBJECTS)
+
+        def storages():
+            for d in az_cmd.get_storage_list():
+                storage = StorageState.build(self, "storages", d["name"]).load(d)
+                yield storage.name, to_dict(storage, YAMLABLE_OBJECTS)
+
+        yield from iter_yaml_mapping("acrs", acrs())
+        yield from iter_yaml_mapping("storages", storages())
+        # kept, services need connection strings to recognize mongo settings
+        self.mongos = {
+            d["name"]: MongoDbState.build(self, "mongos", d["name"]).load()
+            for d in az_cmd.list_cosmos_dbs()
+        }
+        yield from iter_yaml_mapping(
+            "mongos",
+            ((k, to_dict(v, YAMLABLE_OBJECTS)) for k, v in self.mongos.items()),
+        )
+        # only raw listing of webapps is buffered to group them by plan
+        by_plan: typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]] = {}
+        for d in az_cmd.list_services():
+            by_plan.setdefault(d["appServicePlanId"].split("/")[-1], []).append(d)
+        sub_cache = self.path.ctx.sub_cache
+        names = [
+            d["name"]
+            for ds in by_plan.values()
+            for d in ds
+            if sub_cache.get(d["name"], d.get("lastModifiedTimeUtc")) is None
+        ]
+        self.prefetched_webapps = set(names)
+        az_cmd.prefetch_webapps(names)
+
+        def services(plan: AppServicePlanState):
+            for d in by_plan.get(plan.name, []):
+                service = ServiceState.build(plan, "services", d["name"]).load(d)
+                yield service.name, to_dict(service, YAMLABLE_OBJECTS)
+
+        plans = az_cmd.get_plan_list()
+        yield "plans:\n" if plans else "plans: {}\n"
+        for d in plans:
+            plan = AppServicePlanState.build(self, "plans", d["name"]).load(d)
+            self.plans[plan.name] = plan
+            plan_dict = to_dict(plan, YAMLABLE_OBJECTS)
+            del plan_dict["services"]
+            yield yaml_entry(plan.name, plan_dict, 2)
+            yield from iter_yaml_mapping("services", services(plan), 4)
+
+    def refresh(self):
+        """
+        Cheaper alternative to `load` for long living contexts. Plans and
+        webapps are relisted, but mounts and settings are reread only for
+        webapps with changed `lastModifiedTimeUtc`, and manifests only for
+        repositories that referenced in config and changed `lastUpdateTime`.
+        Storages and mongos are not refreshed.
+        """
+        config: WebServicesConfig = self.path.get_config()
+        self.load_service_plans(
+            unchanged={
+                name: service
+                for plan in vars(self).get("plans", {}).values()
+                for name, service in plan.services.items()
+            }
+        )
+        for acr in vars(self).get("acrs", {}).values():
+            acr.refresh(
+                sorted(
+                    set(
+                        service.container.repo
+                        for plan in config.plans.values()
+                        for service in plan.services.values()
+                        if service.container.acr == acr.name
+                    )
+                )
+            )
+        return self
 
     def find_all_tags_in_use(self, repo: RepositoryState) -> typing.List[str]:
         acr: AcrState = repo.path.parent(2).get_state()
@@ -585,6 +958,330 @@ class WebServicesState(WebServicesConfig):
         ]
 
 
+def find_drift(root: CtxPath) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Read only comparison of config and state.
+
+    :return: `[{"path": [...], "change": "create"|"delete"|"update",
+        "fields": {field: [in_config, in_state]}}, ...]`
+    """
+    drift: typing.List[typing.Dict[str, typing.Any]] = []
+
+    def add(presence: CtxPresence, fields=None):
+        if not presence.in_state:
+            change = "create"
+        elif not presence.in_config:
+            change = "delete"
+        else:
+            change = "update"
+        entry: typing.Dict[str, typing.Any] = {
+            "path": list(presence.path.parts),
+            "change": change,
+        }
+        if fields:
+            entry["fields"] = {k: list(v) for k, v in fields.items()}
+        drift.append(entry)
+
+    for section in ("acrs", "storages", "mongos"):
+        for presence in root.child(section).all_presences():
+            if not (presence.in_config and presence.in_state):
+                add(presence)
+    for plan in root.child("plans").all_presences():
+        if not (plan.in_config and plan.in_state):
+            add(plan)
+            continue
+        fields = plan.get_state().differences()
+        if fields:
+            add(plan, fields)
+        for service in plan.path.child("services").all_presences():
+            if not (service.in_config and service.in_state):
+                add(service)
+                continue
+            fields = service.get_state().differences()
+            if fields:
+                add(service, fields)
+    return drift
+
+
+def _digest(*parts: typing.Any) -> str:
+    data = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def reconcile_hashes(root: CtxPath) -> typing.Dict[str, str]:
+    """
+    Merkle hashes of plans (`plan`) and services (`plan/service`) over
+    config, with tags resolved to digests, and over state as plan and webapp
+    lists show it. Hash of plan covers hashes of its services, so plan that
+    hashes the same as when it was last applied can be skipped whole.
+    Mounts and settings are not read: changing them bumps
+    `lastModifiedTimeUtc` of webapp, that is covered.
+    """
+    hashes = {}
+    config: typing.Any
+    state: typing.Any
+    for plan in root.child("plans").all_presences():
+        services = []
+        for service in plan.path.child("services").all_presences():
+            config = state = None
+            if service.in_config:
+                config = service.get_config().resolved_dict()
+            if service.in_state:
+                ss: ServiceState = service.get_state()
+                state = [ss.docker, ss.state, ss.last_modified]
+            key = f"{plan.name()}/{service.name()}"
+            hashes[key] = _digest(config, state)
+            services.append([service.name(), hashes[key]])
+        config = state = None
+        if plan.in_config:
+            p: AppServicePlan = plan.get_config()
+            location = root.ctx.state.location_id(p.location)
+            config = [p.sku, p.kind, location]
+        if plan.in_state:
+            ps: AppServicePlanState = plan.get_state()
+            state = [ps.sku, ps.kind, ps.location]
+        hashes[plan.name()] = _digest(config, state, services)
+    return hashes
+
+
+class AppliedHashes:
+    """
+    `reconcile_hashes` of resource group as of last successful
+    `syncup_apps`, in `applied/<group>.json` of cache dir
+    """
+
+    def __init__(self, group: str, cache_dir: Path = None):
+        cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+        self.file = cache_dir / "applied" / f"{group}.json"
+
+    def load(self) -> typing.Dict[str, str]:
+        try:
+            return json.loads(self.file.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, hashes: typing.Dict[str, str]):
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.file.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(hashes, indent=0, sort_keys=True))
+            os.replace(tmp, self.file)
+        except OSError:  # next run compares everything
+            pass
+
+
+class SubResourceCache:
+    """
+    Mounts and mongo connections of webapps, that stay valid while webapp
+    `lastModifiedTimeUtc` does not change. Connections kept as `(db, idx)`
+    so there is no secrets to persist. Disabled without `cache_dir`.
+    """
+
+    file: typing.Optional[Path]
+    entries: typing.Dict[str, typing.Dict[str, typing.Any]]
+
+    def __init__(self, cache_dir: Path = None):
+        self.cache_dir = cache_dir
+        self.file = None
+        self.entries = {}
+
+    def open(self, group: str):
+        if self.cache_dir is not None:
+            self.file = self.cache_dir / f"{group}.webapps.json"
+            if self.file.exists():
+                self.entries = json.loads(self.file.read_text())
+
+    def get(self, name: str, last_modified: str):
+        entry = self.entries.get(name)
+        if self.file is None or last_modified is None or entry is None:
+            return None
+        if entry["last_modified"] != last_modified:
+            return None
+        return entry["shares"], entry["connections"]
+
+    def put(self, name: str, last_modified: str, shares, connections):
+        if self.file is None:
+            return
+        self.entries[name] = {
+            "last_modified": last_modified,
+            "shares": [
+                {
+                    **d,
+                    "value": {k: v for k, v in d["value"].items() if k != "accessKey"},
+                }
+                for d in shares
+            ],
+            "connections": connections,
+        }
+
+    def save(self):
+        if self.file is not None:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            self.file.write_text(json.dumps(self.entries))
+
+
+def azup_version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("azup")
+    except Exception:  # no `importlib.metadata` before 3.8, or not installed
+        return "dev"
+
+
+_sources_digest: typing.Optional[str] = None
+
+
+def sources_digest() -> str:
+    """
+    sha256 of azup modules, as parsing and casting of config is spread over
+    them, and they change without version bump in dev checkouts
+    """
+    global _sources_digest
+    if _sources_digest is None:
+        h = hashlib.sha256(azup_version().encode("utf-8"))
+        for file in sorted(Path(azup.__file__).parent.glob("*.py")):
+            h.update(file.name.encode("utf-8"))
+            h.update(file.read_bytes())
+        _sources_digest = h.hexdigest()
+    return _sources_digest
+
+
+class CompiledConfigCache:
+    """
+    Pickled `WebServicesConfig` trees keyed by sha256 of YAML content and
+    azup sources, so unchanged config skips YAML parsing and type casting.
+    Only the latest pickle of every config file is kept. Off when `enabled`
+    is false or `$AZUP_CONFIG_CACHE` is `off`.
+    """
+
+    def __init__(self, cache_dir: Path = None, enabled: bool = True):
+        self.dir = (CACHE_DIR if cache_dir is None else cache_dir) / "config"
+        self.enabled = enabled and os.environ.get("AZUP_CONFIG_CACHE") != "off"
+
+    def file(self, config_file, text: bytes) -> Path:
+        """
+        Pickle of `text` read from `config_file`, named `<path hash>-<key>`
+        so older pickles of the same file can be found
+        """
+        path = hashlib.sha256(str(Path(config_file).resolve()).encode("utf-8"))
+        h = hashlib.sha256(sources_digest().encode("utf-8"))
+        h.update(text)
+        return self.dir / f"{path.hexdigest()[:16]}-{h.hexdigest()}.pickle"
+
+    def load(self, config_file, root: CtxPath) -> "WebServicesConfig":
+        text = Path(config_file).read_bytes()
+        if not self.enabled:
+            return load_from_text(text, root, WebServicesConfig)
+        file = self.file(config_file, text)
+        if file.exists():
+            _unpickling.ctx = root.ctx
+            try:
+                with file.open("rb") as fp:
+                    return _TreeUnpickler(fp).load()
+            except Exception:  # stale, broken or foreign, compile again
+                pass
+            finally:
+                _unpickling.ctx = None
+        config = load_from_text(text, root, WebServicesConfig)
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            tmp = file.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(pickle.dumps(config, pickle.HIGHEST_PROTOCOL))
+            os.replace(tmp, file)
+            prefix = file.name.split("-")[0]
+            for old in self.dir.glob(f"{prefix}-*.pickle"):
+                if old != file:
+                    old.unlink()
+        except OSError:  # cache is optional
+            pass
+        return config
+
+
+class _SnapshotPickler(pickle.Pickler):
+    def __init__(self, file, secrets: azup.Secrets):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.secrets = secrets
+
+    def persistent_id(self, obj):
+        if isinstance(obj, str) and obj in self.secrets.keys:
+            return self.secrets.keys[obj]
+        return None
+
+
+# globals, besides state and config classes of this module, that snapshots
+# and compiled configs may refer to
+_PICKLED_GLOBALS = {
+    ("builtins", "set"),
+    ("builtins", "frozenset"),
+    ("datetime", "datetime"),
+    ("datetime", "timedelta"),
+    ("datetime", "timezone"),
+    (__name__, "_rebind_path"),
+}
+
+
+class _TreeUnpickler(pickle.Unpickler):
+    """
+    Snapshots are shared and compiled configs are in a cache directory, so
+    they are not trusted to name anything else
+    """
+
+    def persistent_load(self, pid):
+        return pid
+
+    def find_class(self, module, name):
+        if (module, name) not in _PICKLED_GLOBALS:
+            cls = globals().get(name) if module == __name__ else None
+            if not (
+                isinstance(cls, type)
+                and (issubclass(cls, ContextAware) or cls in (Container, ImageVer))
+            ):
+                raise pickle.UnpicklingError(f"not allowed: {module}.{name}")
+        return super().find_class(module, name)
+
+
+def save_snapshot(ctx: "Context", file):
+    """
+    Pickles loaded state, every secret known to `ctx.secrets` is replaced
+    with its name, so snapshot could be shared.
+    """
+    ctx.state.prefetch(ALL_STATE)
+    snapshot = {
+        "version": azup_version(),
+        "group": ctx.state.group,
+        "created": ctx.az_cmd.utcnow().isoformat(),
+        "state": ctx.state,
+    }
+    with open(file, "wb") as fp:
+        _SnapshotPickler(fp, ctx.secrets).dump(snapshot)
+
+
+def load_snapshot(ctx: "Context", file) -> WebServicesState:
+    _unpickling.ctx = ctx
+    try:
+        with open(file, "rb") as fp:
+            snapshot = _TreeUnpickler(fp).load()
+    finally:
+        _unpickling.ctx = None
+    if snapshot["group"] != ctx.config.group:
+        raise ValueError(
+            f"{file} is snapshot of {snapshot['group']}, not {ctx.config.group}"
+        )
+    azup.print_err(f"State from snapshot of {snapshot['created']}")
+    return snapshot["state"]
+
+
+# everything `WebServicesState` could load
+ALL_STATE = (
+    "location_mapping",
+    "acrs.repos.vers",
+    "mongos",
+    "storages.shares",
+    "plans.services.mounts",
+)
+
+
 YAMLABLE_OBJECTS = (
     WebServicesConfig,
     AppServicePlan,
@@ -605,6 +1302,7 @@ class Context:
     state: WebServicesState
     az_cmd: "AzCmd"
     secrets: azup.Secrets
+    sub_cache: SubResourceCache
 
     str_factories: typing.Dict[typing.Type, typing.Callable] = {}
     dict_factories: typing.Dict[typing.Type, typing.Callable] = {}
@@ -613,31 +1311,51 @@ class Context:
         self.az_cmd = az_cmd
         az_cmd.ctx = self
         self.secrets = azup.Secrets()
+        self.sub_cache = SubResourceCache()
 
     def root(self):
         return CtxPath(self)
 
-    def load_config(self, config_file):
+    def load_config(
+        self, config_file, state_file=None, needs: typing.Iterable[str] = ()
+    ):
+        """
+        :param state_file: snapshot to use instead of loading state from azure
+        :param needs: state subtrees to prefetch, see `WebServicesState.prefetch`
+        """
         self.init_context(
-            lambda root: load_from_file(config_file, root, WebServicesConfig)
+            # replayed runs leave no trace in cache
+            lambda root: CompiledConfigCache(
+                enabled=self.az_cmd.replay_from is None
+            ).load(config_file, root),
+            load=state_file is None,
+            needs=needs,
         )
+        if state_file is not None:
+            self.state = load_snapshot(self, state_file)
 
     def init_context(
-        self, config_factory: typing.Callable[[CtxPath], WebServicesConfig]
+        self,
+        config_factory: typing.Callable[[CtxPath], WebServicesConfig],
+        load: bool = True,
+        needs: typing.Iterable[str] = (),
     ):
         root = self.root()
         root.ctx.dict_factories = build_factory_dict(YAMLABLE_OBJECTS)
         root.ctx.str_factories = azup.FROM_STR_FACTORIES
         self.config = config_factory(root)
         self.state = WebServicesState(root)
-        self.state.load()
+        if load:
+            self.state.load().prefetch(needs)
 
 
 from azup.cmd import AzCmd
 from azup.yaml import (
     build_factory_dict,
-    load_from_file,
+    diff_dicts,
+    iter_yaml_mapping,
+    load_from_text,
     setattrs_from_dict,
     to_dict,
-    to_yaml,
+    yaml_entry,
 )
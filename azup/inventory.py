@@ -0,0 +1,206 @@
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+import azup
+import azup.context as c
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    grp TEXT PRIMARY KEY, updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plans (
+    grp TEXT, name TEXT, sku TEXT, kind TEXT, location TEXT,
+    PRIMARY KEY (grp, name)
+);
+CREATE TABLE IF NOT EXISTS services (
+    grp TEXT, plan TEXT, name TEXT, state TEXT, last_modified TEXT,
+    host TEXT, acr TEXT, repo TEXT, tag TEXT,
+    PRIMARY KEY (grp, name)
+);
+CREATE INDEX IF NOT EXISTS services_image ON services (acr, repo, tag);
+CREATE TABLE IF NOT EXISTS mounts (
+    grp TEXT, service TEXT, path TEXT, account TEXT, share TEXT, state TEXT,
+    PRIMARY KEY (grp, service, path)
+);
+CREATE INDEX IF NOT EXISTS mounts_share ON mounts (account, share);
+CREATE TABLE IF NOT EXISTS mongo_connections (
+    grp TEXT, service TEXT, name TEXT, db TEXT, conn_used INTEGER,
+    PRIMARY KEY (grp, service, name)
+);
+CREATE TABLE IF NOT EXISTS repos (
+    grp TEXT, acr TEXT, name TEXT,
+    PRIMARY KEY (grp, acr, name)
+);
+CREATE TABLE IF NOT EXISTS images (
+    grp TEXT, acr TEXT, repo TEXT, digest TEXT, timestamp TEXT, git TEXT,
+    labels TEXT, in_use INTEGER, purge INTEGER,
+    PRIMARY KEY (grp, acr, repo, digest)
+);
+CREATE INDEX IF NOT EXISTS images_timestamp ON images (timestamp);
+CREATE TABLE IF NOT EXISTS image_ids (
+    grp TEXT, acr TEXT, repo TEXT, id TEXT, digest TEXT,
+    PRIMARY KEY (grp, acr, repo, id)
+);
+"""
+
+TABLES = (
+    "groups",
+    "plans",
+    "services",
+    "mounts",
+    "mongo_connections",
+    "repos",
+    "images",
+    "image_ids",
+)
+
+# name -> (sql, default params)
+NAMED_QUERIES: Dict[str, Tuple[str, Dict[str, Any]]] = {
+    "old_images": (
+        """
+        SELECT s.grp, s.name, s.acr, s.repo, s.tag, i.timestamp
+        FROM services s
+        JOIN image_ids t
+            ON t.grp = s.grp AND t.acr = s.acr AND t.repo = s.repo AND t.id = s.tag
+        JOIN images i
+            ON i.grp = t.grp AND i.acr = t.acr AND i.repo = t.repo
+            AND i.digest = t.digest
+        WHERE i.timestamp < datetime('now', '-' || :days || ' days')
+        ORDER BY i.timestamp
+        """,
+        {"days": 90},
+    ),
+    "unused_repos": (
+        """
+        SELECT r.grp, r.acr, r.name FROM repos r
+        WHERE NOT EXISTS (
+            SELECT 1 FROM images i
+            WHERE i.grp = r.grp AND i.acr = r.acr AND i.repo = r.name AND i.in_use
+        )
+        ORDER BY r.grp, r.acr, r.name
+        """,
+        {},
+    ),
+    "mounts": (
+        """
+        SELECT account, share, grp, service, path FROM mounts
+        ORDER BY account, share, grp, service, path
+        """,
+        {},
+    ),
+    "purge": (
+        """
+        SELECT grp, acr, repo, digest, timestamp FROM images WHERE purge
+        ORDER BY grp, acr, repo, timestamp
+        """,
+        {},
+    ),
+}
+
+
+def default_db() -> Path:
+    return c.CACHE_DIR / "inventory.sqlite"
+
+
+class Inventory:
+    """
+    Index of `WebServicesState` trees of many resource groups. Each export
+    replaces rows of its group only.
+    """
+
+    def __init__(self, file: Path = None):
+        file = default_db() if file is None else Path(file)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(file))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def export(self, state: c.WebServicesState, updated: str):
+        """
+        Call `RepositoryState.to_remove()` first to have `in_use` and
+        `purge` of images set.
+        """
+        grp = state.group
+        with self.db:
+            for table in TABLES:
+                self.db.execute(f"DELETE FROM {table} WHERE grp = ?", (grp,))
+            self.db.execute("INSERT INTO groups VALUES (?, ?)", (grp, updated))
+            for table, rows in iter_rows(state):
+                self.db.executemany(
+                    f"INSERT OR REPLACE INTO {table} VALUES "
+                    f"({', '.join('?' * len(rows[0]))})",
+                    rows,
+                )
+
+    def query(
+        self, sql: str, params: Dict[str, Any] = None
+    ) -> Tuple[List[str], List[Tuple]]:
+        """
+        :param sql: name from `NAMED_QUERIES` or sql with `:name` params
+        :return: column names and rows
+        """
+        all_params: Dict[str, Any] = {}
+        if sql in NAMED_QUERIES:
+            sql, defaults = NAMED_QUERIES[sql]
+            all_params.update(defaults)
+        all_params.update(params or {})
+        cursor = self.db.execute(sql, all_params)
+        return [d[0] for d in cursor.description], cursor.fetchall()
+
+
+def sql_timestamp(dt: datetime) -> str:
+    """
+    Same format as sqlite `datetime()`, so it can be compared with it.
+    Manifest timestamps are naive UTC.
+
+    >>> sql_timestamp(azup.dt_iso_parse("2021-01-01T05:00:00Z"))
+    '2021-01-01 05:00:00'
+    """
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def iter_rows(state: c.WebServicesState) -> Iterator[Tuple[str, List[Tuple]]]:
+    grp = state.group
+    plans, services, mounts, connections = [], [], [], []
+    for plan in state.plans.values():
+        plans.append((grp, plan.name, plan.sku, plan.kind, plan.location))
+        for svc in plan.services.values():
+            s: c.ServiceState = svc  # type: ignore
+            ct = s.container
+            services.append(
+                (grp, plan.name, s.name, s.state, s.last_modified)
+                + (ct.host, ct.acr, ct.repo, ct.tag)
+            )
+            for m in s.mounts.values():
+                ms: c.MountState = m  # type: ignore
+                mounts.append((grp, s.name, ms.name, ms.account, ms.share, ms.state))
+            for mc in s.mongo_connections.values():
+                connections.append((grp, s.name, mc.name, mc.db, mc.conn_used))
+    repos, images, image_ids = [], [], []
+    for acr in state.acrs.values():
+        for r in acr.repos.values():
+            repo: c.RepositoryState = r  # type: ignore
+            repos.append((grp, acr.name, repo.name))
+            for iv in repo.vers:
+                images.append(
+                    (grp, acr.name, repo.name, iv.digest)
+                    + (sql_timestamp(iv.timestamp), iv.git)
+                    + (" ".join(iv.labels), c.IN_USE in iv.tags, c.PURGE in iv.tags)
+                )
+                for id in sorted(iv.all_ids()):
+                    image_ids.append((grp, acr.name, repo.name, id, iv.digest))
+    for table, rows in (
+        ("plans", plans),
+        ("services", services),
+        ("mounts", mounts),
+        ("mongo_connections", connections),
+        ("repos", repos),
+        ("images", images),
+        ("image_ids", image_ids),
+    ):
+        if rows:
+            yield table, rows
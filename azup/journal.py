@@ -0,0 +1,121 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import azup.context as c
+
+CREATE_PLAN = "create_plan"
+UPDATE_PLAN = "update_plan"
+DELETE_PLAN = "delete_plan"
+CREATE_SERVICE = "create_service"
+DELETE_SERVICE = "delete_service"
+RESTART = "restart"
+TAG_SERVICE = "tag_service"
+
+PLANNED = "planned"
+STARTED = "started"
+DONE = "done"
+
+
+class Op(NamedTuple):
+    """
+    >>> Op(RESTART, "plan1", "svc1")
+    restart plan1/svc1
+    """
+
+    op: str
+    plan: str
+    service: str = ""
+
+    def __repr__(self):
+        return f"{self.op} {self.plan}{'/' if self.service else ''}{self.service}"
+
+
+class Journal:
+    """
+    Operations of `syncup_apps` for one resource group. Whole plan is
+    written at once (atomically), and then every operation is marked
+    `started` and `done` with an fsynced line, so run that died is resumed
+    from the first operation not done. Removed when run completes.
+    Without `file` journal is kept in memory only.
+
+    >>> j = Journal()
+    >>> j.plan([Op(CREATE_PLAN, "p"), Op(RESTART, "p", "s")], "abc")
+    >>> j.mark(j.pending()[0], STARTED)
+    >>> j.pending(), j.status[Op(CREATE_PLAN, "p")]
+    ([create_plan p, restart p/s], 'started')
+    """
+
+    file: Optional[Path]
+    config_hash: Optional[str]
+    ops: List[Op]
+    status: Dict[Op, str]
+
+    def __init__(self, file: Path = None):
+        self.file = file
+        self.config_hash = None
+        self.ops = []
+        self.status = {}
+        if file is not None and file.exists():
+            self._read(file)
+
+    @classmethod
+    def for_group(cls, group: str, cache_dir: Path = None) -> "Journal":
+        journal_dir = (c.CACHE_DIR if cache_dir is None else cache_dir) / "journal"
+        return cls(journal_dir / f"{group}.jsonl")
+
+    def _read(self, file: Path):
+        with file.open("rt") as fp:
+            for line in fp:
+                if not line.endswith("\n"):
+                    break  # torn write of run that died
+                entry = json.loads(line)
+                if "config" in entry:
+                    self.config_hash = entry["config"]
+                    continue
+                op = Op(entry["op"], entry["plan"], entry["service"])
+                if entry["status"] == PLANNED:
+                    self.ops.append(op)
+                self.status[op] = entry["status"]
+
+    def pending(self) -> List[Op]:
+        return [op for op in self.ops if self.status[op] != DONE]
+
+    def plan(self, ops: Iterable[Op], config_hash: str):
+        """
+        Replaces whatever was planned before
+        """
+        self.ops = list(dict.fromkeys(ops))
+        self.status = {op: PLANNED for op in self.ops}
+        self.config_hash = config_hash
+        if self.file is None:
+            return
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.file.with_suffix(f".{os.getpid()}.tmp")
+        with tmp.open("wt") as fp:
+            fp.write(json.dumps({"config": config_hash}) + "\n")
+            for op in self.ops:
+                fp.write(self._line(op, PLANNED))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, self.file)
+
+    def mark(self, op: Op, status: str):
+        self.status[op] = status
+        if self.file is None:
+            return
+        with self.file.open("at") as fp:
+            fp.write(self._line(op, status))
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def complete(self):
+        self.ops = []
+        self.status = {}
+        if self.file is not None and self.file.exists():
+            self.file.unlink()
+
+    @staticmethod
+    def _line(op: Op, status: str) -> str:
+        return json.dumps({**op._asdict(), "status": status}) + "\n"
@@ -1,31 +1,80 @@
+import os
 import sys
-from typing import List, Dict
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Tuple
 
-import azup.context as c
-from azup import CliActions, filter_options, print_err
-from azup.cmd import AzCmd
-from azup.yaml import to_yaml
+from azup import CliActions, filter_options, needs, print_err
+
+if TYPE_CHECKING:
+    import azup.context as c
+    from azup.cmd import AzCmd
+    from azup.journal import Journal, Op
+
+# `azup.context`, `azup.cmd` and `azup.yaml` pull `yaml`, `dateutil` and
+# `subprocess`, so they imported only when action actually runs, and not to
+# print usage.
+
+
+DEFAULT_MAX_WORKERS = 4
 
 
 class Actions(CliActions):
-    def __init__(self, az_cmd: AzCmd):
+    def __init__(self, az_cmd: "AzCmd" = None, options: Dict[str, Any] = None):
         super(Actions, self).__init__()
-        self.ctx = c.Context(az_cmd)
+        self._az_cmd = az_cmd
+        self._ctx: "c.Context" = None
+        self.options = {} if options is None else options
+
+    @property
+    def ctx(self) -> "c.Context":
+        if self._ctx is None:
+            import azup.context as c
+            from azup.cmd import AzCmd
 
+            self._ctx = c.Context(AzCmd() if self._az_cmd is None else self._az_cmd)
+            self._ctx.az_cmd.apply_options(self.options)
+        return self._ctx
+
+    @needs("plans")
     def list_images(self, config_yml):
-        self.ctx.load_config(config_yml)
-        out = []
+        """
+        Prints every repository as soon as its manifests are loaded.
+        `-format:jsonl` or `-format:tsv` print one image per line.
+        """
+        import json
+
+        import azup.context as c
+
+        fmt = self.options.get("format")
+        self._load_config(config_yml, read_only=True)
+        if fmt == "tsv":
+            yield "\t".join(IMAGE_FIELDS) + "\n"
         for acr_name, acr in self.ctx.state.acrs.items():
             for repo_name in acr.repos:
                 repo: c.RepositoryState = acr.repos[repo_name]
                 repo.to_remove()
-                out.append(f"Repo: {acr_name}{c.ACR_SUFFIX}/{repo_name}")
-                for iv in repo.vers:
-                    out.append(str(iv))
-        return "\n".join(out) + "\n"
+                rows = [
+                    {"acr": acr_name, "repo": repo_name, **iv.as_dict()}
+                    for iv in repo.vers
+                ]
+                if fmt == "jsonl":
+                    yield "".join(json.dumps(row) + "\n" for row in rows)
+                elif fmt == "tsv":
+                    yield "".join(tsv_line(row) for row in rows)
+                else:
+                    yield f"Repo: {acr_name}{c.ACR_SUFFIX}/{repo_name}\n" + "".join(
+                        f"{iv}\n" for iv in repo.vers
+                    )
 
+    @needs("acrs.repos.vers", "plans")
     def purge_acr(self, config_yml):
-        self.ctx.load_config(config_yml)
+        """
+        `-dry` only reports images that would be purged
+        """
+        import azup.context as c
+
+        dry = "dry" in self.options
+        self._load_config(config_yml, read_only=dry)
         for acr_name, acr in self.ctx.state.acrs.items():
             for repo_name in acr.repos:
                 repo: c.RepositoryState = acr.repos[repo_name]
@@ -33,89 +82,459 @@ class Actions(CliActions):
                 if len(to_remove):
                     print_err(f"Repo: {acr_name}/{repo_name}")
                     for iv in to_remove:
-                        print_err(f"purge: {iv}")
-                        print_err(self.ctx.az_cmd.delete_acr_image(iv))
+                        if dry:
+                            print_err(f"would purge: {iv}")
+                        else:
+                            print_err(f"purge: {iv}")
+                            print_err(self.ctx.az_cmd.delete_acr_image(iv))
 
+    @needs("location_mapping", "plans")
     def syncup_apps(self, config_yml):
+        """
+        Operations are journaled in `~/.cache/azup/journal/<group>.jsonl`, so
+        run that died is resumed from first operation not done, without
+        loading state again. `-fresh` discards unfinished journal.
+        Hashes of config and state as of last successful run are kept in
+        `~/.cache/azup/applied/<group>.json`, plans and services that hash
+        the same are not compared, and their mounts and settings not read.
+        Neither are of webapps without hashes, that are tagged with
+        fingerprint of config as it is now. `-verify` compares everything.
+        """
+        import hashlib
+        from pathlib import Path
+
+        import azup.context as c
+        from azup.journal import Journal
+
+        self._load_config(config_yml, prefetch=False)
+        config_hash = hashlib.sha256(Path(config_yml).read_bytes()).hexdigest()
+        journal = Journal.for_group(self.ctx.config.group)
+        if journal.pending() and journal.config_hash != config_hash:
+            print_err(f"config changed, unfinished journal discarded: {journal.file}")
+        elif journal.pending() and "fresh" not in self.options:
+            print_err(f"resuming {len(journal.pending())} operations: {journal.file}")
+            self._run_ops(journal)
+            return
+        self.ctx.state.prefetch(self._needs)
+        applied = c.AppliedHashes(self.ctx.config.group)
+        journal.plan(self._plan_ops(applied.load()), config_hash)
+        self._run_ops(journal)
+        applied.save(c.reconcile_hashes(self.ctx.root()))
+
+    def snapshot(self, config_yml, state_file):
+        """
+        Saves loaded state to be used offline by read only actions with
+        `-state:<file>`
+        """
+        import azup.context as c
+
         self.ctx.load_config(config_yml)
-        plans_path = self.ctx.root().child("plans")
-        # Delete services and plans that not mentioned in config, and create plans
-        # that does not exist in azure
-        need_restarts: Dict[str,c.Service] = {}
-        need_reload = False
-        for plan in plans_path.all_presences():
-
-            if not plan.in_state:
-                plan.get_config().create()
-                need_reload = True
+        c.save_snapshot(self.ctx, state_file)
+
+    @needs("acrs.repos.vers", "plans.services.mounts")
+    def inventory(self, config_yml):
+        """
+        Exports state into sqlite `-db:<file>`, replacing only rows of its
+        resource group. Works with `-state:<file>` as well.
+        """
+        from azup.inventory import Inventory
+
+        self._load_config(config_yml, read_only=True)
+        for acr in self.ctx.state.acrs.values():
+            for repo in acr.repos.values():
+                repo.to_remove()  # type:ignore
+        inventory = Inventory(self.options.get("db"))
+        try:
+            inventory.export(self.ctx.state, self.ctx.az_cmd.utcnow().isoformat())
+        finally:
+            inventory.close()
+
+    def query(self, sql):
+        """
+        Runs named query (`old_images`, `unused_repos`, `mounts`, `purge`) or
+        sql against inventory `-db:<file>`. Other options are parameters of
+        query: `azup query old_images -days:30`. Prints tab separated rows.
+        """
+        from azup.inventory import Inventory
+
+        inventory = Inventory(self.options.get("db"))
+        try:
+            columns, rows = inventory.query(sql, self.options)
+        finally:
+            inventory.close()
+        return "".join(
+            "\t".join("" if v is None else str(v) for v in row) + "\n"
+            for row in [columns, *rows]
+        )
+
+    def _load_config(self, config_yml, read_only=False, prefetch=True):
+        state_file = self.options.get("state")
+        if state_file is not None and not read_only:
+            raise ValueError("-state:<file> is only for read only actions")
+        self.ctx.load_config(config_yml, state_file, self._needs if prefetch else ())
+
+    @needs("location_mapping", "plans.services.mounts")
+    def watch(self, config_yml):
+        """
+        Keeps context in memory and reconciles every `-interval` (5m by
+        default). Config reread only when file changes, otherwise state is
+        refreshed incrementally. `-runs:N` stops after N reconciles.
+        """
+        from azup import to_timedelta
+
+        interval = to_timedelta(self.options.get("interval", "5m")).total_seconds()
+        runs = int(self.options.get("runs", 0))
+        config_stamp = None
+        n = 0
+        while True:
+            self.ctx.az_cmd.memo.clear()  # memo is valid for one reconcile only
+            try:
+                stamp = file_stamp(config_yml)
+                if stamp != config_stamp:
+                    config_stamp = None
+                    self._load_config(config_yml)
+                    config_stamp = stamp
+                else:
+                    self.ctx.state.refresh()
+                self._reconcile()
+            except Exception as e:
+                print_err(f"reconcile failed: {e!r}")
+                config_stamp = None  # start from scratch next time
+            n += 1
+            if runs and n >= runs:
+                return
+            self.ctx.az_cmd.sleep(interval)
+
+    def _reconcile(self):
+        from azup.journal import Journal
+
+        journal = Journal()
+        journal.plan(self._plan_ops(), "")
+        self._run_ops(journal)
+
+    def _plan_ops(self, applied: Dict[str, str] = None) -> List["Op"]:
+        """
+        Operations that bring azure in line with config, from state as it is
+        now: plans that cannot be updated are recreated with all services,
+        changed services are recreated, and every created service or service
+        of plan with new sku is restarted at the end.
+
+        :param applied: `reconcile_hashes` as of last successful run, plans
+            and services that still hash the same are left alone
+        """
+        import azup.context as c
+        from azup.journal import (
+            CREATE_PLAN,
+            CREATE_SERVICE,
+            DELETE_PLAN,
+            DELETE_SERVICE,
+            RESTART,
+            TAG_SERVICE,
+            UPDATE_PLAN,
+            Op,
+        )
+
+        # plans and services that go away or recreated, then updates
+        removals: List[Op] = []
+        updates: List[Op] = []
+        restarts = {}
+        verify = "verify" in self.options
+        hashes = {}
+        if applied and not verify:
+            hashes = c.reconcile_hashes(self.ctx.root())
+
+        def unchanged(key: str) -> bool:
+            return key in hashes and (applied or {}).get(key) == hashes[key]
+
+        def changed(plan: str, service: "c.CtxPresence") -> bool:
+            state: c.ServiceState = service.get_state()
+            key = f"{plan}/{service.name()}"
+            if unchanged(key):
+                return False
+            # webapp modified since it was last applied from here is compared,
+            # fingerprint only stands for runs that have not applied it
+            if not verify and key not in (applied or {}):
+                if state.fingerprint_matches():
+                    return False
+            return bool(state.differences())
+
+        for plan in self.ctx.root().child("plans").all_presences():
+            name = plan.name()
+            if unchanged(name):
+                continue
+            if plan.in_state and plan.in_config and plan.get_state().can_update():
+                sku_changed = plan.get_state().sku != plan.get_config().sku
+                if sku_changed:
+                    updates.append(Op(UPDATE_PLAN, name))
+                for service in plan.path.child("services").all_presences():
+                    delete = Op(DELETE_SERVICE, name, service.name())
+                    create = Op(CREATE_SERVICE, name, service.name())
+                    if not service.in_config:
+                        removals.append(delete)
+                        continue
+                    if not service.in_state:
+                        updates.append(create)
+                    elif changed(name, service):
+                        updates.extend([delete, create])
+                    else:
+                        # created before fingerprints, or by hand
+                        if not service.get_state().fingerprint_matches():
+                            updates.append(Op(TAG_SERVICE, name, service.name()))
+                        if not sku_changed:
+                            continue
+                    restarts[service.name()] = Op(RESTART, name, service.name())
                 continue
-            elif plan.in_config:
-                if plan.get_state().can_update():
-                    for service in plan.path.child("services").all_presences():
-                        if not service.in_config:
-                            service.get_state().delete()
-                            need_reload = True
-                    continue
-
-            need_reload = True
-            for service in plan.get_state().services.values():
-                service.delete()
-            plan.get_state().delete()
+            if plan.in_state:
+                for service_name in plan.get_state().services:
+                    removals.append(Op(DELETE_SERVICE, name, service_name))
+                removals.append(Op(DELETE_PLAN, name))
             if plan.in_config:
-                plan.get_config().create()
-
-        # Reload all plans
-        if need_reload:
-            self.ctx.state.load_service_plans()
-
-        # All plans should be present in both config and state,
-        # just to ensure that they are updated, and then create or update all
-        # it's services
-        for plan in plans_path.all_presences():
-            assert plan.in_state and plan.in_config, f"{plan} should be created already"
-            plan_updated = plan.get_state().update()
-
-            for service in plan.path.child("services").all_presences():
-                assert service.in_config, f"{service} should be mentioned in config"
-                if plan_updated:
-                    need_restarts[service.path.key()] = service.get_config()
-                if not service.in_state:
-                    service.get_config().create()
-                    need_restarts[service.path.key()] = service.get_config()
-                else:
-                    if service.get_state().update():
-                        need_restarts[service.path.key()] = service.get_config()
+                removals.append(Op(CREATE_PLAN, name))
+                for service_name in plan.get_config().services:
+                    updates.append(Op(CREATE_SERVICE, name, service_name))
+                    restarts[service_name] = Op(RESTART, name, service_name)
+        return removals + updates + [restarts[n] for n in sorted(restarts)]
 
-        for service_name in sorted(need_restarts):
-            need_restarts[service_name].restart()
+    def _run_ops(self, journal: "Journal"):
+        """
+        Runs operations not done yet. Ones that were started by run that died
+        are checked first, whether they took effect.
+        """
+        from azup.journal import DONE, STARTED
 
+        for op in journal.pending():
+            started = journal.status[op] == STARTED
+            journal.mark(op, STARTED)
+            self._run_op(op, started)
+            journal.mark(op, DONE)
+        journal.complete()
 
+    def _run_op(self, op: "Op", started: bool):
+        import azup.context as c
+        from azup.journal import (
+            CREATE_PLAN,
+            CREATE_SERVICE,
+            DELETE_PLAN,
+            DELETE_SERVICE,
+            RESTART,
+            TAG_SERVICE,
+            UPDATE_PLAN,
+        )
 
+        az_cmd = self.ctx.az_cmd
+        plan_path = self.ctx.root().child("plans", op.plan)
+        service_path = plan_path.child("services", op.service)
+        # state already loaded is kept up to date by rereading only what
+        # operation touched
+        state = self.ctx.state if c.is_loaded(self.ctx.state, "plans") else None
+        if op.op == CREATE_PLAN:
+            plan_id = None
+            if not (started and az_cmd.app_plan_exists(op.plan)):
+                plan_id = plan_path.get_config().create()
+            if state is not None:
+                state.refresh_plan(op.plan, plan_id)
+        elif op.op == UPDATE_PLAN:
+            az_cmd.update_app_plan_sku(plan_path.get_config())
+            if state is not None:
+                state.refresh_plan(op.plan)
+        elif op.op == DELETE_PLAN:
+            if not started or az_cmd.app_plan_exists(op.plan):
+                az_cmd.delete_app_plan(
+                    c.AppServicePlanState(plan_path).set(name=op.plan)
+                )
+            if state is not None:
+                state.drop_plan(op.plan)
+        elif op.op == DELETE_SERVICE:
+            if not started or az_cmd.webapp_exists(op.service):
+                az_cmd.delete_webapp(c.ServiceState(service_path).set(name=op.service))
+            if state is not None and op.plan in state.plans:
+                state.plans[op.plan].drop_service(op.service)  # type:ignore
+        elif op.op == CREATE_SERVICE:
+            if started and az_cmd.webapp_exists(op.service):
+                # mounts or settings may be missing, so created again
+                az_cmd.delete_webapp(c.ServiceState(service_path).set(name=op.service))
+            service_id = service_path.get_config().create()
+            if state is not None and op.plan in state.plans:
+                plan: c.AppServicePlanState = state.plans[op.plan]  # type:ignore
+                plan.refresh_services([service_id or az_cmd.site_uri(op.service)])
+        elif op.op == RESTART:
+            service_path.get_config().restart()
+        elif op.op == TAG_SERVICE:
+            service: c.Service = service_path.get_config()
+            az_cmd.tag_webapp(service, {c.FINGERPRINT_TAG: service.fingerprint()})
+            if state is not None and op.plan in state.plans:
+                state.plans[op.plan].refresh_services(  # type:ignore
+                    [az_cmd.site_uri(op.service)]
+                )
+        else:
+            raise ValueError(f"unknown operation: {op}")
 
 
 
 
-    def dump_config(self, resource_group):
-        self.ctx.init_context(
-            lambda root: c.WebServicesState(root).set(group=resource_group)
+
+
+
+    @needs("acrs", "storages", "mongos", "plans.services.mounts")
+    def diff(self, config_yml):
+        """
+        Reports drift between config and azure without changing anything.
+        Mounts and settings of webapps that were not modified since previous
+        `diff` are taken from `-cache:<dir>`. `-format:json` for scripts.
+        """
+        import json
+        from pathlib import Path
+
+        import azup.context as c
+
+        self.ctx.sub_cache = c.SubResourceCache(
+            Path(self.options.get("cache", c.CACHE_DIR))
         )
+        self._load_config(config_yml, read_only=True)
+        drift = c.find_drift(self.ctx.root())
+        self.ctx.sub_cache.save()
+        if self.options.get("format") == "json":
+            return json.dumps(drift, indent=2) + "\n"
+        signs = {"create": "+", "delete": "-", "update": "~"}
+        out = []
+        for entry in drift:
+            out.append(f"{signs[entry['change']]} {'>'.join(entry['path'])}")
+            for field, (in_config, in_state) in entry.get("fields", {}).items():
+                out.append(f"    {field}: {in_state} -> {in_config}")
+        return "".join(f"{l}\n" for l in out)
+
+    def batch(self, action, *targets):
+        """
+        Runs `action` for every config (or resource group for `dump_config`)
+        in one process. Every target gets its own context, but account,
+        locations and acr credentials fetched only once. Concurrency is
+        limited by `-max_workers:N` option.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        from azup.cmd import DeadlineExceeded
+
+        if action == "batch" or action not in self._actions:
+            raise ValueError(f"{action} cannot be batched")
+        az_cmd = self.ctx.az_cmd
+        max_workers = int(self.options.get("max_workers", DEFAULT_MAX_WORKERS))
+        if az_cmd.replay_from is not None and getattr(
+            az_cmd.replay_from, "strict", True
+        ):
+            max_workers = 1  # player expects commands in recorded order
+
+        def run_one(target):
+            start = time.monotonic()
+            if az_cmd.deadline is not None and az_cmd.deadline <= start:
+                return target, "cancelled", 0.0, None
+            actions = Actions(az_cmd.fork(f"{target}: "), self.options)
+            try:
+                out = actions._invoke(action, target)
+                if out is not None and not isinstance(out, str):
+                    out = "".join(out)
+                status = "ok"
+            except DeadlineExceeded:
+                out, status = None, "cancelled"
+            except Exception as e:
+                print_err(f"{target}: {e!r}")
+                out, status = None, f"failed: {e!r}"
+            return target, status, time.monotonic() - start, out
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(run_one, targets))
+
+        out = []
+        for target, _, _, target_out in results:
+            if target_out:
+                out.append(f"# {target}\n{target_out}")
+        out.append("SUMMARY:")
+        for target, status, elapsed, _ in results:
+            out.append(f" {target} {status} {elapsed:.1f}s")
+        return "\n".join(out) + "\n"
+
+    def dump_config(self, resource_group):
+        """
+        With `-stream` YAML is printed section by section while it is loaded
+        """
+        import azup.context as c
+        from azup.yaml import to_yaml
+
+        def config_factory(root):
+            return c.WebServicesState(root).set(group=resource_group)
+
+        stream = "stream" in self.options
+        self.ctx.init_context(config_factory, load=not stream)
+        if stream:
+            return self.ctx.state.iter_yaml()
         return to_yaml(self.ctx.state, c.YAMLABLE_OBJECTS)
 
 
-def main(args: List[str] = sys.argv[1:], az_cmd: AzCmd = None):
+IMAGE_FIELDS = (
+    "acr",
+    "repo",
+    "digest",
+    "timestamp",
+    "git",
+    "labels",
+    "purge",
+    "in_use",
+)
+
+
+def tsv_line(row: Dict[str, Any]) -> str:
+    """
+    >>> tsv_line({"acr": "a", "repo": "r", "digest": "sha256:1",
+    ...     "timestamp": "2021-01-01T00:00:00", "git": None, "labels": ["v1", "v2"],
+    ...     "purge": False, "in_use": True})
+    'a\\tr\\tsha256:1\\t2021-01-01T00:00:00\\t\\tv1,v2\\t0\\t1\\n'
+    """
+
+    def cell(v):
+        if isinstance(v, bool):
+            return str(int(v))
+        if isinstance(v, list):
+            return ",".join(v)
+        return "" if v is None else str(v)
+
+    return "\t".join(cell(row[f]) for f in IMAGE_FIELDS) + "\n"
+
+
+def file_stamp(file: str) -> Tuple[int, int]:
+    st = os.stat(file)
+    return st.st_mtime_ns, st.st_size
+
+
+def main(args: List[str] = sys.argv[1:], az_cmd: "AzCmd" = None):
     args, options = filter_options(args)
-    if az_cmd is None:
-        az_cmd = AzCmd()
-    actions = Actions(az_cmd)
+    actions = Actions(az_cmd, options)
     actions._show_help = len(args) == 0 or "h" in options
     out = actions._invoke(*args)
     if actions._show_help:
         print_err(actions._help)
+    if "stats" in options:
+
+        def print_stats():
+            print_err(f"stats: {actions.ctx.az_cmd.rate.stats()}")
+
+        if out is None or isinstance(out, str):
+            print_stats()
+        else:
+            out = then(out, print_stats)
     return out
 
 
+def then(chunks: Iterable[str], fn: Callable[[], None]) -> Iterator[str]:
+    yield from chunks
+    fn()
+
+
 def print_main():
-    print(main() or "")
+    out = main()
+    if out is None or isinstance(out, str):
+        print(out or "")
+    else:
+        for chunk in out:
+            print(chunk, end="", flush=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+import base64
+import gzip
+import http.client
+import json
+import re
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+ARM_URL = "https://management.azure.com"
+# `{registry}` replaced with name of registry
+ACR_URL = "https://{registry}.azurecr.io"
+ACR_PAGE_SIZE = 100
+TOKEN_MARGIN = 5 * 60  # seconds before expiry when token is fetched again
+
+LINK_NEXT_RE = re.compile(r'<([^>]+)>\s*;\s*rel="?next"?')
+
+
+class RestError(Exception):
+    """
+    Non 2xx response
+
+    >>> e = RestError(429, "Too Many Requests",
+    ...     b'{"error": {"code": "TooManyRequests", "message": "slow down"}}',
+    ...     {"retry-after": "7"})
+    >>> print(e.az_err())
+    ERROR: (TooManyRequests) slow down
+    Status: 429 Too Many Requests Retry-After: 7
+    >>> print(RestError(503, "Service Unavailable", b"<html/>", {}).az_err())
+    ERROR: (503) <html/>
+    Status: 503 Service Unavailable
+    """
+
+    def __init__(self, status: int, reason: str, body: bytes, headers: Dict[str, str]):
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.headers = headers
+        super().__init__(f"{status} {reason}")
+
+    def az_err(self) -> str:
+        """
+        Error in shape of `az` stderr, so failures are classified and retried
+        the same way as failed commands
+        """
+        text = self.body.decode("utf-8", "replace")
+        code, message = str(self.status), text
+        try:
+            error = json.loads(text)
+        except ValueError:
+            error = None
+        if isinstance(error, dict):
+            # arm: {"error": {...}}, acr: {"errors": [{...}]}
+            error = error.get("error") or (error.get("errors") or [None])[0]
+        if isinstance(error, dict):
+            code = error.get("code", code)
+            message = error.get("message", message)
+        status = f"Status: {self.status} {self.reason}"
+        retry_after = self.headers.get("retry-after")
+        if retry_after:
+            status += f" Retry-After: {retry_after}"
+        return f"ERROR: ({code}) {message}\n{status}"
+
+
+def token_expiry(token: Dict[str, Any]) -> float:
+    """
+    Epoch seconds when token from `az account get-access-token` expires
+
+    >>> token_expiry({"accessToken": "t", "expires_on": 1650000000})
+    1650000000.0
+    """
+    if token.get("expires_on"):
+        return float(token["expires_on"])
+    # older az: local time without zone
+    return datetime.strptime(token["expiresOn"], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+
+
+def link_next(link: Optional[str]) -> Optional[str]:
+    """
+    Next page from `Link` header, the way ACR pages its listings
+
+    >>> link_next('</acr/v1/_catalog?last=b&n=2>; rel="next"')
+    '/acr/v1/_catalog?last=b&n=2'
+    >>> link_next(None)
+    """
+    m = LINK_NEXT_RE.search(link or "")
+    return m.group(1) if m else None
+
+
+class TokenCache:
+    """
+    Bearer tokens by resource, fetched again only when about to expire
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Tuple[str, float]],
+        margin: float = TOKEN_MARGIN,
+    ):
+        """
+        :param fetch: returns token and its expiry in epoch seconds
+        """
+        self.fetch = fetch
+        self.margin = margin
+        self.tokens: Dict[str, Tuple[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, resource: str) -> str:
+        with self.lock:
+            token, expires = self.tokens.get(resource, ("", 0.0))
+            if expires - self.margin <= time.time():
+                token, expires = self.tokens[resource] = self.fetch(resource)
+            return token
+
+
+class ConnectionPool:
+    """
+    Idle keep-alive connections by scheme and host, so consecutive requests
+    to the same host skip connect and TLS handshake
+    """
+
+    def __init__(self, max_idle: int = 4):
+        self.max_idle = max_idle
+        self.idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self.lock = threading.Lock()
+
+    def acquire(
+        self, scheme: str, netloc: str, timeout: float
+    ) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        :return: connection and whether it was reused
+        """
+        with self.lock:
+            idle = self.idle.get((scheme, netloc))
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=timeout), False
+        return http.client.HTTPConnection(netloc, timeout=timeout), False
+
+    def release(self, scheme: str, netloc: str, conn: http.client.HTTPConnection):
+        with self.lock:
+            idle = self.idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle.clear()
+
+
+class RestClient:
+    """
+    Reads ARM and ACR REST endpoints directly, over pooled connections
+    """
+
+    def __init__(
+        self,
+        tokens: TokenCache,
+        arm: str = ARM_URL,
+        acr: str = ACR_URL,
+        pool: ConnectionPool = None,
+    ):
+        self.tokens = tokens
+        self.arm = arm
+        self.acr = acr
+        self.pool = ConnectionPool() if pool is None else pool
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        auth: str,
+        timeout: float,
+        body: Any = None,
+    ) -> Tuple[Any, Dict[str, str]]:
+        """
+        :return: decoded json and lowercased headers
+        :raise RestError: on non 2xx response
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(("", "", parts.path, parts.query, ""))
+        headers = {"Authorization": auth, "Accept-Encoding": "gzip"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif method != "GET":
+            data = b""
+        while True:
+            conn, reused = self.pool.acquire(parts.scheme, parts.netloc, timeout)
+            try:
+                conn.request(method, path, data, headers)
+                resp = conn.getresponse()
+                content = resp.read()
+            except (ConnectionError, http.client.HTTPException):
+                conn.close()
+                if reused:  # server closed idle connection, try fresh one
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            break
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.release(parts.scheme, parts.netloc, conn)
+        resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+        if resp_headers.get("content-encoding") == "gzip":
+            content = gzip.decompress(content)
+        if not 200 <= resp.status < 300:
+            raise RestError(resp.status, resp.reason, content, resp_headers)
+        return json.loads(content) if content.strip() else None, resp_headers
+
+    def iter_pages(
+        self, url: str, auth: str, key: str, timeout: float
+    ) -> Iterator[Any]:
+        """
+        Items under `key` of every page, following `nextLink` of ARM and
+        `Link` header of ACR
+        """
+        while url:
+            page, headers = self.request("GET", url, auth, timeout)
+            yield from page.get(key) or []
+            next_url = page.get("nextLink") or link_next(headers.get("link"))
+            url = urllib.parse.urljoin(url, next_url) if next_url else ""
+
+    def arm_auth(self) -> str:
+        return f"Bearer {self.tokens.get(ARM_URL)}"
+
+    def arm_url(self, path: str, api_version: str) -> str:
+        sep = "&" if "?" in path else "?"
+        return f"{self.arm}{path}{sep}api-version={api_version}"
+
+    def arm_list(self, path: str, api_version: str, timeout: float) -> List[Any]:
+        return list(
+            self.iter_pages(
+                self.arm_url(path, api_version), self.arm_auth(), "value", timeout
+            )
+        )
+
+    def arm_post(self, path: str, api_version: str, timeout: float) -> Any:
+        url = self.arm_url(path, api_version)
+        return self.request("POST", url, self.arm_auth(), timeout)[0]
+
+    def acr_url(self, registry: str, path: str) -> str:
+        return self.acr.format(registry=registry) + path
+
+    def acr_get(
+        self, registry: str, path: str, credentials: Tuple[str, str], timeout: float
+    ) -> Any:
+        url = self.acr_url(registry, path)
+        return self.request("GET", url, basic_auth(*credentials), timeout)[0]
+
+    def acr_list(
+        self,
+        registry: str,
+        path: str,
+        key: str,
+        credentials: Tuple[str, str],
+        timeout: float,
+    ) -> List[Any]:
+        url = f"{self.acr_url(registry, path)}?n={ACR_PAGE_SIZE}"
+        return list(self.iter_pages(url, basic_auth(*credentials), key, timeout))
+
+
+def basic_auth(username: str, password: str) -> str:
+    """
+    >>> basic_auth("acr1", "pwd")
+    'Basic YWNyMTpwd2Q='
+    """
+    pair = f"{username}:{password}".encode("utf-8")
+    return f"Basic {base64.b64encode(pair).decode('ascii')}"
@@ -0,0 +1,311 @@
+import json
+
+import pytest
+
+import azup
+import azup.context as c
+from azup.cmd import AzCmd, Player, Recorder
+from azup.tests.fake_az import AZ_STATE, FakeAz
+from azup.yaml import build_factory_dict
+
+CONFIG = {
+    "group": "grp",
+    "acrs": {"acr1": {"repos": {"app": {}}}},
+    "storages": {"st1": {"shares": {"share1": {"quota": 100, "key_used": 0}}}},
+    "mongos": {"mongo1": {}},
+    "plans": {
+        "plan1": {
+            "sku": "B1",
+            "kind": "linux",
+            "location": "East US",
+            "services": {
+                "svc": {
+                    "container": {"acr": "acr1", "repo": "app", "tag": "v1"},
+                    "mounts": {
+                        "/d": {"account": "st1", "share": "share1"},
+                        "/e": {"account": "st1", "share": "share1"},
+                    },
+                    "mongo_connections": {
+                        "MONGO": {"db": "mongo1", "conn_used": 0},
+                        "MONGO2": {"db": "mongo1", "conn_used": 1},
+                    },
+                }
+            },
+        }
+    },
+}
+
+
+def replay_context(records) -> c.Context:
+    """
+    Context with config from `CONFIG` and state that already knows
+    credentials, keys and tags, so only mutations are replayed
+    """
+    ctx = c.Context(AzCmd(replay_from=Player(records)))
+    root = ctx.root()
+    ctx.dict_factories = build_factory_dict(c.YAMLABLE_OBJECTS)
+    ctx.str_factories = azup.FROM_STR_FACTORIES
+    ctx.config = c.WebServicesConfig.from_dict(root, CONFIG)  # type:ignore
+    state = ctx.state = c.WebServicesState(root).set(group="grp")
+    acr = c.AcrState.build(state, "acrs", "acr1").set(
+        name="acr1", credentials=("acr1", "pwd")
+    )
+    repo = c.RepositoryState.build(acr, "repos", "app")
+    iv = c.ImageVer(
+        repo.path, {"digest": "sha256:a", "timestamp": "2021-01-01", "tags": ["v1"]}
+    )
+    acr.repos = {"app": repo.set(name="app", vers=[iv], by_tag={"v1": iv})}
+    state.acrs = {"acr1": acr}
+    state.storages = {
+        "st1": c.StorageState.build(state, "storages", "st1").set(
+            name="st1", keys=["key1"]
+        )
+    }
+    state.mongos = {
+        "mongo1": c.MongoDbState.build(state, "mongos", "mongo1").set(
+            name="mongo1", connections=["mongodb://cs1", "mongodb://cs2"]
+        )
+    }
+    return ctx
+
+
+def test_create_batches_mounts_and_settings():
+    svc_path = ("plans", "plan1", "services", "svc")
+    fingerprint = replay_context([]).root().child(*svc_path).get_config().fingerprint()
+    records = [
+        [
+            "az webapp create -n svc -g grp -p plan1 "
+            "-i acr1.azurecr.io/app@sha256:a -s acr1 -w pwd --only-show-errors",
+            0,
+            "{}",
+            "",
+        ],
+        ["az account show", 0, '{"id": "sub1"}', ""],
+        [
+            "az rest --method put --uri /subscriptions/sub1/resourceGroups/grp"
+            "/providers/Microsoft.Web/sites/svc/config/azurestorageaccounts"
+            "?api-version=2022-03-01 --body "
+            '{"properties":{'
+            '"_d":{"type":"AzureFiles","accountName":"st1","shareName":"share1",'
+            '"accessKey":"key1","mountPath":"/d"},'
+            '"_e":{"type":"AzureFiles","accountName":"st1","shareName":"share1",'
+            '"accessKey":"key1","mountPath":"/e"}}} --only-show-errors',
+            0,
+            "{}",
+            "",
+        ],
+        [
+            "az webapp config appsettings set -n svc -g grp "
+            "--settings MONGO=mongodb://cs1 MONGO2=mongodb://cs2",
+            0,
+            "[]",
+            "",
+        ],
+        [
+            f"az webapp update -n svc -g grp --set tags.azup_fp={fingerprint} "
+            "--only-show-errors",
+            0,
+            "{}",
+            "",
+        ],
+    ]
+    ctx = replay_context(records)
+    ctx.root().child(*svc_path).get_config().create()
+    ctx.az_cmd.replay_from.assert_at_the_end()
+
+
+def test_single_mount_uses_storage_account_add():
+    records = [
+        [
+            "az webapp config storage-account add --resource-group grp --name svc "
+            "--custom-id _d --storage-type AzureFiles --share-name share1 "
+            "--account-name st1 --access-key key1 --mount-path /d --only-show-errors",
+            0,
+            "{}",
+            "",
+        ],
+    ]
+    ctx = replay_context(records)
+    service = ctx.root().child("plans", "plan1", "services", "svc").get_config()
+    ctx.az_cmd.mount_shares(service, [service.mounts["/d"]])
+    ctx.az_cmd.replay_from.assert_at_the_end()
+
+
+def test_streamed_items_hold_rate_slot(tmp_path):
+    from azup.cmd import service_of
+
+    listing = tmp_path / "list.json"
+    listing.write_text(json.dumps([0, 1, 2]))
+    cmd = f"cat {listing}"
+    az = c.Context(AzCmd()).az_cmd
+    window = az.rate.window(service_of(cmd))
+    items = az.q_items(cmd)
+    assert next(items) == 0
+    assert window.active == 1
+    assert list(items) == [1, 2]
+    assert window.active == 0
+
+
+def test_transient_failure_of_read_retried():
+    fake = FakeAz()
+    fake.failures.append("ERROR: Operation returned 503 ServiceUnavailable")
+    az = c.Context(AzCmd(replay_from=fake)).az_cmd
+    assert az.q("az acr list -g grp").json() == [{"name": "acr1"}]
+    assert fake.cmds == ["az acr list -g grp"] * 2
+    assert az.rate.stats()["retries"] == 1
+
+
+def test_permanent_failure_of_streamed_read_not_retried():
+    from azup.cmd import is_read
+
+    cmd = "ls list /nonexistent"  # fails like missing resource
+    assert is_read(cmd)
+    az = c.Context(AzCmd()).az_cmd
+    pauses = []
+    az.retry_pause = lambda cmd, run, attempt: pauses.append(run)  # type:ignore
+    with pytest.raises(ValueError):
+        list(az.q_items(cmd))
+    with pytest.raises(ValueError):
+        az.q(cmd)
+    assert pauses == []
+    assert az.rate.stats()["retries"] == 0
+
+
+def test_timeout_kills_command():
+    from azup.cmd import TIMEOUT_RC, TRANSIENT, CmdRun, classify
+
+    run = CmdRun("sleep 5", log=lambda s: None, timeout=0.2)
+    assert run.rc == TIMEOUT_RC
+    assert classify(run) == TRANSIENT
+    run = CmdRun("sleep 5", log=lambda s: None, stream=True, timeout=0.2)
+    assert "".join(run.iter_out()) == ""
+    assert run.rc == TIMEOUT_RC
+
+
+def test_timeout_kills_children_of_command(tmp_path):
+    import time
+
+    # like `az`: shell script that runs the actual work in a child process
+    script = tmp_path / "az"
+    script.write_text("#!/bin/sh\nsleep 5\necho []\n")
+    script.chmod(0o755)
+    az = c.Context(AzCmd()).az_cmd
+    az.apply_options({"timeouts": "other=1s"})
+    cmd = f"{script} webapp update"
+    for run in (lambda: az.q(cmd), lambda: list(az.q_items(cmd))):
+        start = time.monotonic()
+        with pytest.raises(ValueError):
+            run()
+        # pipes are not held open by orphaned `sleep`
+        assert time.monotonic() - start < 3
+
+
+def test_streamed_failure_keeps_its_error():
+    from azup.cmd import PERMANENT, CmdRun, classify
+
+    run = CmdRun("ls /nonexistent", log=lambda s: None, stream=True, timeout=100)
+    assert "".join(run.iter_out()) == ""
+    assert run.rc not in (0, 124)
+    assert "nonexistent" in run.err
+    assert classify(run) == PERMANENT
+
+
+def test_early_stop_of_streamed_items_cancels_killer(tmp_path):
+    import threading
+
+    listing = tmp_path / "list.json"
+    listing.write_text(json.dumps(list(range(100000))))
+    az = c.Context(AzCmd()).az_cmd
+    items = az.q_items(f"cat {listing}")
+    assert next(items) == 0
+    items.close()
+    timers = [t for t in threading.enumerate() if isinstance(t, threading.Timer)]
+    for t in timers:
+        t.join(1)
+        assert not t.is_alive()
+
+
+def test_deadline_stops_before_running():
+    from azup.cmd import DeadlineExceeded
+
+    az = AzCmd()
+    az.apply_options({"deadline": "0s", "timeouts": "read=1m"})
+    assert az.timeouts["read"] == 60
+    with pytest.raises(DeadlineExceeded):
+        az.q("az acr list -g grp")
+
+
+def test_prefetch_webapps_with_arm_batch():
+    names = [f"app{i}" for i in range(15)]
+    mounts = {"d": {"mountPath": "/d", "accountName": "st1", "shareName": "share1"}}
+    webapps = {
+        n: {"plan": "plan1", "docker": "", "mounts": mounts, "settings": {"A": n}}
+        for n in names
+        if n != "app3"
+    }
+    fake = FakeAz({**AZ_STATE, "webapps": webapps})
+    ctx = replay_context([])
+    az_cmd = ctx.az_cmd
+    az_cmd.replay_from = fake
+    az_cmd.apply_options({"arm_batch": ""})
+    az_cmd.prefetch_webapps(names)
+    assert len(fake.cmds) == 3  # account + 30 requests in 2 batches
+    app = c.ServiceState(ctx.root()).set(name="app7")
+    assert az_cmd.get_app_settings(app) == [
+        {"name": "A", "value": "app7", "slotSetting": False}
+    ]
+    shares = az_cmd.list_webapp_shares(app)
+    assert shares[0]["name"] == "d" and shares[0]["value"]["mountPath"] == "/d"
+    assert len(fake.cmds) == 3
+    # failed in batch, so read on its own
+    with pytest.raises(ValueError):
+        az_cmd.get_app_settings(c.ServiceState(ctx.root()).set(name="app3"))
+    assert fake.cmds[3] == "az webapp config appsettings list -n app3 -g grp"
+
+
+def test_inventory_from_resource_graph_pages(monkeypatch):
+    monkeypatch.setattr("azup.cmd.GRAPH_PAGE_SIZE", 4)
+    fake = FakeAz()
+    ctx = replay_context([])
+    az_cmd = ctx.az_cmd
+    az_cmd.replay_from = fake
+    az_cmd.apply_options({"graph": ""})
+    assert [d["name"] for d in az_cmd.get_acr_list()] == ["acr1"]
+    assert az_cmd.get_plan_list()[0]["sku"] == {"name": "B1"}
+    assert [d["name"] for d in az_cmd.list_services()] == ["svc1", "old"]
+    assert len(fake.cmds) == 3  # account and two pages, reused from memo
+    body = json.loads(fake.cmds[1].split(" --body ")[1])
+    assert "resourceGroup =~ 'grp'" in body["query"]
+    assert body["subscriptions"] == ["sub1"]
+    az_cmd.invalidate("webapp", "x")
+    assert not az_cmd.graph
+
+
+def test_list_commands_project_fields():
+    fake = FakeAz()
+    ctx = replay_context([])
+    ctx.az_cmd.replay_from = fake
+    plan = ctx.state.plans["plan1"]
+    assert (plan.sku, plan.kind, plan.location) == ("B1", "linux", "eastus")
+    plan_list = next(cmd for cmd in fake.cmds if "plan list" in cmd).split()
+    query = plan_list[plan_list.index("--query") + 1]
+    assert query.startswith("[?resourceGroup=='grp'].{name:name,sku:{name:sku.name}")
+
+
+def test_recorded_latency_replayed_concurrently(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.chdir(tmp_path)
+    rec = Recorder("timed.json", ["x"])
+    c.Context(AzCmd(record_to=rec)).az_cmd.q("sleep 0.1")
+    cmd, rc, _, _, elapsed = rec.records[0]
+    assert (cmd, rc) == ("sleep 0.1", 0) and elapsed >= 0.1
+
+    play = Player([[f"sleep {i}", 0, "", "", 0.2] for i in range(4)], 1, 0, False)
+    az = c.Context(AzCmd(replay_from=play)).az_cmd
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda i: az.q(f"sleep {i}"), [3, 1, 2, 0]))
+    play.assert_at_the_end()
+    report = play.report()
+    assert report["recorded"] == 0.8 and report["wall"] < 0.6
+    assert report["speedup"] > 1.3
@@ -0,0 +1,201 @@
+import json
+
+import pytest
+import yaml
+
+import azup.context as c
+import azup.yaml
+from azup.cmd import SHARE_QUERY, AzCmd
+from azup.tests.cmd_tests import CONFIG, replay_context
+from azup.tests.fake_az import FARMS, SITES, FakeAz
+from azup.yaml import build_factory_dict, to_dict
+
+
+def new_root() -> c.CtxPath:
+    ctx = c.Context(AzCmd())
+    ctx.dict_factories = build_factory_dict(c.YAMLABLE_OBJECTS)
+    return ctx.root()
+
+
+def test_compiled_config_skips_parsing(tmp_path, monkeypatch):
+    monkeypatch.delenv("AZUP_CONFIG_CACHE", raising=False)
+    config_yml = tmp_path / "config.yml"
+    config_yml.write_text(yaml.dump(CONFIG))
+    cache = c.CompiledConfigCache(tmp_path)
+    first = cache.load(config_yml, new_root())
+    assert len(list((tmp_path / "config").glob("*.pickle"))) == 1
+
+    def no_parsing(*args):
+        raise AssertionError("parsed again")
+
+    monkeypatch.setattr(c, "load_from_text", no_parsing)
+    root = new_root()
+    second = cache.load(config_yml, root)
+    assert to_dict(second, c.YAMLABLE_OBJECTS) == to_dict(first, c.YAMLABLE_OBJECTS)
+    svc = second.plans["plan1"].services["svc"]
+    assert svc.path.ctx is root.ctx
+    assert svc.container.host == "acr1.azurecr.io"
+
+    config_yml.write_text(yaml.dump({**CONFIG, "group": "grp2"}))
+    monkeypatch.setattr(c, "load_from_text", azup.yaml.load_from_text)
+    assert cache.load(config_yml, new_root()).group == "grp2"
+    other_yml = tmp_path / "other.yml"
+    other_yml.write_text(yaml.dump(CONFIG))
+    cache.load(other_yml, new_root())
+    # previous pickle of config.yml replaced
+    assert len(list((tmp_path / "config").glob("*.pickle"))) == 2
+
+    monkeypatch.setattr(c, "_sources_digest", "edited")  # any module changed
+    assert cache.load(config_yml, new_root()).group == "grp2"
+    assert len(list((tmp_path / "config").glob("*.pickle"))) == 2
+
+
+def test_compiled_config_refuses_foreign_globals(tmp_path, monkeypatch, capfd):
+    import pickle
+
+    monkeypatch.delenv("AZUP_CONFIG_CACHE", raising=False)
+    config_yml = tmp_path / "config.yml"
+    config_yml.write_text(yaml.dump(CONFIG))
+    cache = c.CompiledConfigCache(tmp_path)
+    file = cache.file(config_yml, config_yml.read_bytes())
+    file.parent.mkdir()
+    file.write_bytes(pickle.dumps(Evil()))
+    assert cache.load(config_yml, new_root()).group == "grp"
+    assert "pwned" not in capfd.readouterr().out
+
+
+def test_compiled_config_cache_off(tmp_path, monkeypatch):
+    config_yml = tmp_path / "config.yml"
+    config_yml.write_text(yaml.dump(CONFIG))
+    c.CompiledConfigCache(tmp_path, enabled=False).load(config_yml, new_root())
+    monkeypatch.setenv("AZUP_CONFIG_CACHE", "off")
+    c.CompiledConfigCache(tmp_path).load(config_yml, new_root())
+    assert not (tmp_path / "config").exists()
+
+
+def test_snapshot_hides_secrets(tmp_path):
+    ctx = replay_context([])
+    ctx.state.set(plans={}, location_mapping={})
+    ctx.state.storages["st1"].shares = {}
+    ctx.secrets.add("hidden_acr_pwd", "pwd")
+    ctx.secrets.add("hidden_connection_string", "mongodb://cs1")
+    file = tmp_path / "grp.snapshot"
+    c.save_snapshot(ctx, file)
+    assert b"mongodb://cs1" not in file.read_bytes()
+
+    loaded = replay_context([])
+    state = c.load_snapshot(loaded, file)
+    assert state.path.ctx is loaded
+    assert state.acrs["acr1"].credentials == ("acr1", ctx.secrets.hide("pwd"))
+    assert state.mongos["mongo1"].connections[1] == "mongodb://cs2"
+    repo = state.acrs["acr1"].repos["app"]
+    assert repo.by_tag["v1"] is repo.vers[0]
+    assert repo.vers[0].repo_path.ctx is loaded
+
+
+class Evil:
+    def __reduce__(self):
+        import os
+
+        return os.system, ("echo pwned",)
+
+
+def test_snapshot_refuses_foreign_globals(tmp_path):
+    import pickle
+
+    file = tmp_path / "grp.snapshot"
+    file.write_bytes(pickle.dumps({"group": "grp", "state": Evil()}))
+    with pytest.raises(pickle.UnpicklingError):
+        c.load_snapshot(replay_context([]), file)
+
+
+def test_state_subtrees_load_on_first_access():
+    shares = [{"name": "share1", "properties": {"quota": 10}}]
+    ctx = replay_context(
+        [
+            [
+                f"az storage share list --account-name st1 --query {SHARE_QUERY}"
+                " --only-show-errors",
+                0,
+                json.dumps(shares),
+                "",
+            ]
+        ]
+    )
+    storage = ctx.state.storages["st1"]
+    assert not c.is_loaded(storage, "shares")
+    ctx.state.prefetch(["storages.shares"])
+    assert storage.shares["share1"].quota == 10
+    ctx.state.prefetch(["storages.shares", "acrs"])
+    ctx.az_cmd.replay_from.assert_at_the_end()
+
+
+def test_targeted_refresh_splices_into_state():
+    fake = FakeAz()
+    fake.state["plans"]["plan1"].update(sku="B2", location="eastus")
+    fake.state["webapps"] = {
+        "svc2": {
+            "plan": "plan1",
+            "docker": "DOCKER|acr1.azurecr.io/app:v1",
+            "mounts": {},
+            "settings": {},
+        }
+    }
+    ctx = replay_context([])
+    ctx.az_cmd.replay_from = fake  # type:ignore
+    state = ctx.state
+    state.location_mapping = {"eastus": "eastus"}
+    old = c.AppServicePlanState.build(state, "plans", "plan1").set(
+        name="plan1", sku="B1", services={"svc": object()}
+    )
+    state.plans = {"plan1": old}
+    plan = state.refresh_plan("plan1", f"{FARMS}/plan1")
+    assert plan.sku == "B2" and list(plan.services) == ["svc"]
+    plan.refresh_services([f"{SITES}/svc2"])
+    plan.drop_service("svc")
+    assert list(plan.services) == ["svc2"]
+    assert plan.services["svc2"].container.tag == "v1"
+    assert [cmd.split(" --query ")[0] for cmd in fake.cmds] == [
+        f"az appservice plan show --ids {FARMS}/plan1",
+        f"az webapp show --ids {SITES}/svc2",
+    ]
+
+
+def test_reconcile_hashes_change_only_up_the_changed_path(tmp_path):
+    ctx = replay_context([])
+    state = ctx.state
+    state.location_mapping = {"eastus": "eastus"}
+    plan = c.AppServicePlanState.build(state, "plans", "plan1").set(
+        name="plan1", sku="B1", kind="linux", location="eastus"
+    )
+    plan.services = {
+        "svc": c.ServiceState.build(plan, "services", "svc").load(
+            {
+                "state": "Running",
+                "siteConfig": {"linuxFxVersion": "DOCKER|acr1.azurecr.io/app@sha256:a"},
+                "lastModifiedTimeUtc": "2022-01-01T00:00:00",
+            }
+        )
+    }
+    state.plans = {"plan1": plan}
+    root = ctx.root()
+    applied = c.reconcile_hashes(root)
+    assert sorted(applied) == ["plan1", "plan1/svc"]
+
+    repo = state.acrs["acr1"].repos["app"]
+    repo.by_tag["sha256:a"] = repo.vers[0]
+    # as `differences` leaves it
+    ctx.config.plans["plan1"].services["svc"].container.tag = "sha256:a"
+    assert c.reconcile_hashes(root) == applied
+
+    ctx.config.plans["plan1"].sku = "B2"
+    hashes = c.reconcile_hashes(root)
+    assert hashes["plan1"] != applied["plan1"]
+    assert hashes["plan1/svc"] == applied["plan1/svc"]
+
+    plan.services["svc"].last_modified = "2022-02-02T00:00:00"
+    assert c.reconcile_hashes(root)["plan1/svc"] != applied["plan1/svc"]
+
+    assert c.AppliedHashes("grp", tmp_path).load() == {}
+    c.AppliedHashes("grp", tmp_path).save(applied)
+    assert c.AppliedHashes("grp", tmp_path).load() == applied
@@ -0,0 +1,274 @@
+import copy
+import json
+import threading
+from typing import Any, Dict, List
+
+from azup.cmd import CmdRun
+
+SITES = "/subscriptions/sub1/resourceGroups/grp/providers/Microsoft.Web/sites"
+FARMS = "/subscriptions/sub1/resourceGroups/grp/providers/Microsoft.Web/serverfarms"
+AZ_STATE: Dict[str, Any] = {
+    "acrs": {
+        "acr1": {
+            "app": [
+                {
+                    "digest": "sha256:aaa",
+                    "timestamp": "2019-01-01T00:00:00Z",
+                    "tags": [],
+                },
+                {
+                    "digest": "sha256:bbb",
+                    "timestamp": "2020-06-01T00:00:00Z",
+                    "tags": ["v1"],
+                },
+            ]
+        }
+    },
+    "mongos": ["mongo1"],
+    "storages": {"st1": {"share1": 100}},
+    "plans": {
+        "plan1": {"sku": "B1", "kind": "linux", "location": "East US"},
+        "plan2": {"sku": "B1", "kind": "linux", "location": "East US"},
+    },
+    "webapps": {
+        "svc1": {
+            "plan": "plan1",
+            "docker": "DOCKER|acr1.azurecr.io/app@sha256:bbb",
+            "mounts": {
+                "_d": {"mountPath": "/d", "accountName": "st1", "shareName": "share1"}
+            },
+            "settings": {"MONGO": "mongodb://mongo1-secret1"},
+        },
+        "old": {
+            "plan": "plan2",
+            "docker": "DOCKER|acr1.azurecr.io/app@sha256:aaa",
+            "mounts": {},
+            "settings": {},
+        },
+    },
+}
+
+
+class FakeAz:
+    """
+    Answers `az` commands from `state` (`AZ_STATE` by default) like azure
+    would, and applies mutations to it. Missing resources fail with
+    ResourceNotFound, and errors queued in `failures` are returned instead of
+    answers, one per command. Output is not projected by `--query`, loaders
+    read only fields they need anyway.
+    """
+
+    strict = False  # answers in any order, so batch runs concurrently
+
+    def __init__(self, state: Dict[str, Any] = None):
+        self.state = copy.deepcopy(AZ_STATE if state is None else state)
+        self.cmds: List[str] = []
+        self.failures: List[str] = []
+        self.lock = threading.Lock()
+        self.modified = 0
+
+    def get(self, cmd: str) -> CmdRun:
+        with self.lock:
+            self.cmds.append(cmd)
+            if self.failures:
+                return CmdRun(cmd, 1, "", self.failures.pop(0))
+            try:
+                out = self.answer(cmd.split()[1:])
+            except KeyError as e:
+                return CmdRun(cmd, 3, "", f"ERROR: (ResourceNotFound) {e}")
+            return CmdRun(cmd, 0, json.dumps(out))
+
+    def site(self, name: str) -> Dict[str, Any]:
+        w = self.state["webapps"][name]
+        return {
+            "name": name,
+            "id": f"{SITES}/{name}",
+            "state": "Running",
+            "siteConfig": {"linuxFxVersion": w["docker"]},
+            "appServicePlanId": f"{FARMS}/{w['plan']}",
+            "lastModifiedTimeUtc": w.get("modified", "2021-01-01T00:00:00"),
+            "tags": w.get("tags", {}),
+        }
+
+    def touch(self, w: Dict[str, Any]):
+        self.modified += 1
+        w["modified"] = f"2021-02-01T00:00:{self.modified:02d}"
+
+    def plan(self, name: str) -> Dict[str, Any]:
+        p = self.state["plans"][name]
+        return {
+            "name": name,
+            "id": f"{FARMS}/{name}",
+            "sku": {"name": p["sku"]},
+            "kind": p["kind"],
+            "location": p["location"],
+            "resourceGroup": "grp",
+        }
+
+    def answer(self, args: List[str]) -> Any:
+        def opt(name):
+            return args[args.index(name) + 1] if name in args else None
+
+        st = self.state
+        name = opt("-n") or opt("--name")
+        words = " ".join(a for a in args[:4] if not a.startswith("-"))
+        if words.startswith("account list-locations"):
+            return [{"name": "eastus", "displayName": "East US"}]
+        if words.startswith("account show"):
+            return {"id": "sub1"}
+        if words.startswith("acr list"):
+            return [{"name": n} for n in st["acrs"]]
+        if words.startswith("acr credential show"):
+            return {
+                "username": name,
+                "passwords": [{"value": "pwd1"}, {"value": "pwd2"}],
+            }
+        if words.startswith("acr repository list"):
+            return sorted(st["acrs"][name])
+        if words.startswith("acr repository show-manifests"):
+            return st["acrs"][name][opt("--repository")]
+        if words.startswith("acr repository show"):
+            ms = st["acrs"][name][opt("--repository")]
+            return {"lastUpdateTime": max(m["timestamp"] for m in ms)}
+        if words.startswith("cosmosdb list"):
+            return [{"name": n} for n in st["mongos"]]
+        if words.startswith("cosmosdb keys list"):
+            cs = [{"connectionString": f"mongodb://{name}-secret{i}"} for i in (1, 2)]
+            return {"connectionStrings": cs}
+        if words.startswith("storage account list"):
+            return [{"name": n, "accessTier": "Hot"} for n in st["storages"]]
+        if words.startswith("storage account keys"):
+            return [{"value": f"{name}-key1"}, {"value": f"{name}-key2"}]
+        if words.startswith("storage share list"):
+            shares = st["storages"][opt("--account-name")]
+            return [{"name": s, "properties": {"quota": q}} for s, q in shares.items()]
+        if words.startswith("appservice plan list"):
+            return [self.plan(n) for n in st["plans"]]
+        if words.startswith("appservice plan show"):
+            ids = opt("--ids")
+            return self.plan(ids.split("/")[-1] if ids else name)
+        if words.startswith("appservice plan update"):
+            st["plans"][name]["sku"] = opt("--sku")
+            return self.plan(name)
+        if words.startswith("appservice plan delete"):
+            del st["plans"][name]
+            return None
+        if words.startswith("webapp list"):
+            return [self.site(n) for n in st["webapps"]]
+        if words.startswith("webapp show"):
+            ids = opt("--ids")
+            return self.site(ids.split("/")[-1] if ids else name)
+        if words.startswith("webapp create"):
+            w = {"plan": opt("-p"), "docker": "DOCKER|" + opt("-i")}
+            st["webapps"][name] = {**w, "mounts": {}, "settings": {}}
+            self.touch(st["webapps"][name])
+            return self.site(name)
+        if words.startswith("webapp update"):
+            w = st["webapps"][name]
+            for i, a in enumerate(args):
+                if a == "--set":
+                    k, v = args[i + 1].split("=", 1)
+                    w.setdefault("tags", {})[k.split(".", 1)[1]] = v
+            self.touch(w)
+            return self.site(name)
+        if words.startswith("webapp delete"):
+            del st["webapps"][name]
+            return None
+        if words.startswith("webapp restart"):
+            return None
+        if words.startswith("webapp config storage-account list"):
+            mounts = st["webapps"][name]["mounts"]
+            return [
+                {"name": cid, "value": {**m, "state": "Ok", "type": "AzureFiles"}}
+                for cid, m in mounts.items()
+            ]
+        if words.startswith("webapp config storage-account add"):
+            w = st["webapps"][name]
+            w["mounts"][opt("--custom-id")] = {
+                "mountPath": opt("--mount-path"),
+                "accountName": opt("--account-name"),
+                "shareName": opt("--share-name"),
+            }
+            self.touch(w)
+            return []
+        if words.startswith("webapp config appsettings list"):
+            settings = st["webapps"][name]["settings"]
+            return [{"name": k, "value": v} for k, v in settings.items()]
+        if words.startswith("webapp config appsettings set"):
+            w = st["webapps"][name]
+            for pair in args[args.index("--settings") + 1 :]:
+                if pair.startswith("-"):
+                    break
+                k, v = pair.split("=", 1)
+                w["settings"][k] = v
+            self.touch(w)
+            return []
+        if words.startswith("rest") and opt("--uri").split("?")[0].endswith("/batch"):
+            requests = json.loads(opt("--body"))["requests"]
+            return {"responses": [self.arm_response(r) for r in requests]}
+        if words.startswith("rest") and "Microsoft.ResourceGraph" in opt("--uri"):
+            return self.graph_page(json.loads(opt("--body"))["options"])
+        raise AssertionError(f"unexpected: az {' '.join(args)}")
+
+    def arm_response(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Response to `appsettings/list` or `azurestorageaccounts/list` request
+        in ARM batch
+        """
+        site, _, config, _ = request["url"].split("?")[0].split("/")[-4:]
+        response = {"name": request["name"], "httpStatusCode": 404, "content": {}}
+        w = self.state["webapps"].get(site)
+        if w is not None:
+            props = w["settings"] if config == "appsettings" else w["mounts"]
+            response.update(httpStatusCode=200, content={"properties": props})
+        return response
+
+    def graph_page(self, options: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Page of Resource Graph query over all resources, `$top` rows after
+        `$skipToken`
+        """
+        st = self.state
+        rows: List[Dict[str, Any]] = [
+            {"type": "Microsoft.ContainerRegistry/registries", "name": n}
+            for n in st["acrs"]
+        ]
+        rows += [
+            {"type": "Microsoft.DocumentDB/databaseAccounts", "name": n}
+            for n in st["mongos"]
+        ]
+        rows += [
+            {
+                "type": "Microsoft.Storage/storageAccounts",
+                "name": n,
+                "properties": {"accessTier": "Hot"},
+            }
+            for n in st["storages"]
+        ]
+        rows += [
+            {**self.plan(n), "type": "Microsoft.Web/serverfarms"} for n in st["plans"]
+        ]
+        for n in st["webapps"]:
+            site = self.site(n)
+            fx = site["siteConfig"]["linuxFxVersion"]
+            props = {
+                "state": site["state"],
+                "serverFarmId": site["appServicePlanId"],
+                "lastModifiedTimeUtc": site["lastModifiedTimeUtc"],
+                "siteProperties": {
+                    "properties": [{"name": "LinuxFxVersion", "value": fx}]
+                },
+            }
+            rows.append(
+                {
+                    "type": "Microsoft.Web/sites",
+                    "name": n,
+                    "tags": site["tags"],
+                    "properties": props,
+                }
+            )
+        skip = int(options.get("$skipToken", 0))
+        page: Dict[str, Any] = {"data": rows[skip : skip + options["$top"]]}
+        if skip + options["$top"] < len(rows):
+            page["$skipToken"] = str(skip + options["$top"])
+        return page
@@ -0,0 +1,47 @@
+import azup.context as c
+from azup.inventory import Inventory
+from azup.tests.cmd_tests import replay_context
+
+
+def loaded_state(group: str) -> c.WebServicesState:
+    state = replay_context([]).state
+    state.group = group
+    plan = c.AppServicePlanState.build(state, "plans", "plan1").set(
+        name="plan1", sku="B1", kind="linux", location="eastus", services={}
+    )
+    svc = c.ServiceState.build(plan, "services", "svc").set(
+        name="svc",
+        state="Running",
+        last_modified="2022-01-01",
+        container=c.Container.parse("DOCKER|acr1.azurecr.io/app:v1"),
+        mongo_connections={},
+    )
+    svc.mounts = {
+        "/d": c.MountState.build(svc, "mounts", "/d").set(
+            name="/d", account="st1", share="share1", state="Ok"
+        )
+    }
+    plan.services["svc"] = svc
+    state.plans = {"plan1": plan}
+    repo: c.RepositoryState = state.acrs["acr1"].repos["app"]  # type:ignore
+    repo.vers[0].set_tag(c.IN_USE, True)
+    return state
+
+
+def test_export_and_query(tmp_path):
+    inventory = Inventory(tmp_path / "inv.sqlite")
+    inventory.export(loaded_state("grp"), "2022-01-02")
+    inventory.export(loaded_state("grp2"), "2022-01-02")
+    inventory.export(loaded_state("grp"), "2022-01-03")
+    columns, rows = inventory.query("old_images", {"days": 30})
+    assert columns[:2] == ["grp", "name"]
+    assert sorted(rows) == [
+        ("grp", "svc", "acr1", "app", "v1", "2021-01-01 00:00:00"),
+        ("grp2", "svc", "acr1", "app", "v1", "2021-01-01 00:00:00"),
+    ]
+    assert inventory.query("unused_repos")[1] == []
+    assert inventory.query("mounts")[1][0] == ("st1", "share1", "grp", "svc", "/d")
+    assert inventory.query(
+        "SELECT updated FROM groups WHERE grp = :grp", {"grp": "grp"}
+    )[1] == [("2022-01-03",)]
+    inventory.close()
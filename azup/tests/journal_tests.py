@@ -0,0 +1,263 @@
+from typing import List
+
+import azup.context as c
+from azup.journal import (
+    CREATE_PLAN,
+    CREATE_SERVICE,
+    DELETE_PLAN,
+    DELETE_SERVICE,
+    DONE,
+    RESTART,
+    STARTED,
+    TAG_SERVICE,
+    UPDATE_PLAN,
+    Journal,
+    Op,
+)
+from azup.main import Actions
+from azup.tests.cmd_tests import CONFIG, replay_context
+from azup.tests.fake_az import AZ_STATE, SITES, FakeAz
+
+
+def test_journal_survives_restart(tmp_path):
+    ops = [Op(DELETE_SERVICE, "plan1", "old"), Op(RESTART, "plan1", "svc")]
+    journal = Journal.for_group("grp", tmp_path)
+    journal.plan(ops, "hash1")
+    journal.mark(ops[0], STARTED)
+    with journal.file.open("at") as fp:
+        fp.write('{"op": "delete_service", "pl')  # died while writing
+
+    resumed = Journal.for_group("grp", tmp_path)
+    assert resumed.config_hash == "hash1"
+    assert resumed.pending() == ops
+    assert resumed.status[ops[0]] == STARTED
+    resumed.complete()
+    assert not resumed.file.exists()
+
+
+def test_resume_checks_started_operation(tmp_path):
+    fake = FakeAz()
+    ctx = replay_context([])
+    ctx.az_cmd.replay_from = fake  # type:ignore
+    actions = Actions(ctx.az_cmd)
+    actions._ctx = ctx
+    ops = [Op(DELETE_SERVICE, "plan1", "gone"), Op(RESTART, "plan1", "svc")]
+    journal = Journal.for_group("grp", tmp_path)
+    journal.plan(ops, "hash1")
+    journal.mark(ops[0], STARTED)
+
+    actions._run_ops(Journal.for_group("grp", tmp_path))
+    assert fake.cmds == [
+        "az webapp show -n gone -g grp --query id",
+        "az webapp restart -n svc -g grp",
+    ]
+    assert not journal.file.exists()
+
+
+def test_done_operations_skipped(tmp_path):
+    fake = FakeAz()
+    ctx = replay_context([])
+    ctx.az_cmd.replay_from = fake  # type:ignore
+    actions = Actions(ctx.az_cmd)
+    actions._ctx = ctx
+    ops = [Op(DELETE_SERVICE, "plan1", "old"), Op(RESTART, "plan1", "svc")]
+    journal = Journal.for_group("grp", tmp_path)
+    journal.plan(ops, "hash1")
+    journal.mark(ops[0], DONE)
+    actions._run_ops(Journal.for_group("grp", tmp_path))
+    assert fake.cmds == ["az webapp restart -n svc -g grp"]
+    assert "old" in fake.state["webapps"]
+
+
+def planning_actions(plans) -> Actions:
+    """
+    Actions over `CONFIG` with `plans` config, and state already loaded.
+    Plans and services added with `plan_state` and `service_state` exist in
+    fake az too
+    """
+    ctx = replay_context([])
+    root = ctx.root()
+    ctx.config = c.WebServicesConfig.from_dict(  # type:ignore
+        root, {**CONFIG, "plans": plans}
+    )
+    ctx.state.location_mapping = {"eastus": "eastus", "westus": "westus"}
+    ctx.state.plans = {}
+    ctx.az_cmd.replay_from = FakeAz(  # type:ignore
+        {**AZ_STATE, "plans": {}, "webapps": {}}
+    )
+    actions = Actions(ctx.az_cmd)
+    actions._ctx = ctx
+    return actions
+
+
+def plan_state(actions: Actions, name: str, sku="B1", location="eastus"):
+    fake: FakeAz = actions.ctx.az_cmd.replay_from  # type:ignore
+    fake.state["plans"][name] = {"sku": sku, "kind": "linux", "location": location}
+    state = actions.ctx.state
+    plan = c.AppServicePlanState.build(state, "plans", name).set(
+        name=name, sku=sku, kind="linux", location=location, services={}
+    )
+    state.plans[name] = plan
+    return plan
+
+
+def service_state(plan, name: str, mounts=("/d", "/e"), fingerprint=None):
+    fake: FakeAz = plan.path.ctx.az_cmd.replay_from
+    fake.state["webapps"][name] = {
+        "plan": plan.name,
+        "docker": "DOCKER|acr1.azurecr.io/app@sha256:a",
+        "mounts": {},
+        "settings": {},
+        "tags": {c.FINGERPRINT_TAG: fingerprint} if fingerprint else {},
+    }
+    svc = c.ServiceState.build(plan, "services", name).load(fake.site(name))
+    svc.mounts = {
+        m: c.MountState.build(svc, "mounts", m).set(
+            name=m, account="st1", share="share1", state="Ok"
+        )
+        for m in mounts
+    }
+    svc.mongo_connections = {
+        n: c.MongoConnectionState.build(svc, "mongo_connections", n).set(
+            name=n, db="mongo1", conn_used=i
+        )
+        for i, n in enumerate(("MONGO", "MONGO2"))
+    }
+    plan.services[name] = svc
+    return svc
+
+
+def ran(fake: FakeAz) -> List[str]:
+    """
+    Commands run by fake az, without output projections and flags
+    """
+    return [
+        cmd.split(" --query ")[0].replace(" --only-show-errors", "")
+        for cmd in fake.cmds
+    ]
+
+
+def fingerprint(actions: Actions) -> str:
+    svc_path = ("plans", "plan1", "services", "svc")
+    return actions.ctx.root().child(*svc_path).get_config().fingerprint()
+
+
+SERVICE = CONFIG["plans"]["plan1"]["services"]["svc"]  # type:ignore
+PLAN = {"sku": "B1", "kind": "linux", "location": "East US"}
+
+
+def test_plan_creates_deletes_and_recreates():
+    actions = planning_actions(
+        {
+            "plan1": {**PLAN, "services": {"svc": SERVICE}},
+            "plan2": {**PLAN, "services": {"b": SERVICE, "a": SERVICE}},
+        }
+    )
+    service_state(plan_state(actions, "old"), "gone")
+    # location cannot be updated, so recreated with its services
+    service_state(plan_state(actions, "plan1", location="westus"), "svc")
+    assert actions._plan_ops() == [
+        Op(DELETE_SERVICE, "old", "gone"),
+        Op(DELETE_PLAN, "old"),
+        Op(DELETE_SERVICE, "plan1", "svc"),
+        Op(DELETE_PLAN, "plan1"),
+        Op(CREATE_PLAN, "plan1"),
+        Op(CREATE_PLAN, "plan2"),
+        Op(CREATE_SERVICE, "plan1", "svc"),
+        Op(CREATE_SERVICE, "plan2", "b"),
+        Op(CREATE_SERVICE, "plan2", "a"),
+        Op(RESTART, "plan2", "a"),
+        Op(RESTART, "plan2", "b"),
+        Op(RESTART, "plan1", "svc"),
+    ]
+
+
+def test_sku_change_updates_plan_and_restarts_its_services():
+    actions = planning_actions({"plan1": {**PLAN, "services": {"svc": SERVICE}}})
+    plan = plan_state(actions, "plan1", sku="B2")
+    service_state(plan, "svc", fingerprint=fingerprint(actions))
+    assert actions._plan_ops() == [
+        Op(UPDATE_PLAN, "plan1"),
+        Op(RESTART, "plan1", "svc"),
+    ]
+
+
+def test_changed_service_recreated_and_removed_one_deleted():
+    actions = planning_actions(
+        {"plan1": {**PLAN, "services": {"svc": SERVICE, "same": SERVICE}}}
+    )
+    plan = plan_state(actions, "plan1")
+    service_state(plan, "svc", mounts=("/d",))
+    service_state(plan, "same")
+    service_state(plan, "extra")
+    assert actions._plan_ops() == [
+        Op(DELETE_SERVICE, "plan1", "extra"),
+        Op(TAG_SERVICE, "plan1", "same"),  # created before fingerprints
+        Op(DELETE_SERVICE, "plan1", "svc"),
+        Op(CREATE_SERVICE, "plan1", "svc"),
+        Op(RESTART, "plan1", "svc"),
+    ]
+
+
+def test_planned_operations_run_in_order():
+    actions = planning_actions({"plan1": {**PLAN, "services": {"svc": SERVICE}}})
+    plan = plan_state(actions, "plan1", sku="B2")
+    service_state(plan, "gone")
+    service_state(plan, "svc")
+    actions._reconcile()
+    fake: FakeAz = actions.ctx.az_cmd.replay_from  # type:ignore
+    assert ran(fake) == [
+        "az webapp delete -n gone -g grp --keep-empty-plan",
+        "az appservice plan update -n plan1 -g grp --sku B1",
+        "az appservice plan show -n plan1 -g grp",
+        "az webapp update -n svc -g grp --set tags.azup_fp=" + fingerprint(actions),
+        "az account show",
+        f"az webapp show --ids {SITES}/svc",
+        "az webapp restart -n svc -g grp",
+    ]
+    assert set(fake.state["webapps"]) == {"svc"}
+    assert fake.state["webapps"]["svc"]["tags"] == {"azup_fp": fingerprint(actions)}
+    assert list(plan.services) == ["svc"]
+    assert actions.ctx.state.plans["plan1"].sku == "B1"
+
+
+def test_syncup_resumes_partly_done_journal(tmp_path, monkeypatch):
+    import hashlib
+
+    import yaml
+
+    monkeypatch.setattr(c, "CACHE_DIR", tmp_path)
+    config_yml = tmp_path / "config.yml"
+    config_yml.write_text(yaml.dump(CONFIG))
+    ops = [
+        Op(DELETE_SERVICE, "plan1", "old"),
+        Op(DELETE_PLAN, "plan2"),
+        Op(RESTART, "plan1", "svc"),
+    ]
+    journal = Journal.for_group("grp", tmp_path)
+    journal.plan(ops, hashlib.sha256(config_yml.read_bytes()).hexdigest())
+    journal.mark(ops[0], STARTED)
+    journal.mark(ops[0], DONE)
+    journal.mark(ops[1], STARTED)
+
+    fake = FakeAz()
+    del fake.state["plans"]["plan2"]
+    Actions(c.AzCmd(replay_from=fake)).syncup_apps(str(config_yml))
+    assert ran(fake) == [
+        "az appservice plan show -n plan2 -g grp",  # gone already
+        "az webapp restart -n svc -g grp",
+    ]
+    assert not journal.file.exists()
+
+
+def test_fingerprint_not_trusted_for_webapp_modified_since_applied():
+    actions = planning_actions({"plan1": {**PLAN, "services": {"svc": SERVICE}}})
+    plan = plan_state(actions, "plan1")
+    # mount removed by hand, that bumped lastModifiedTimeUtc
+    service_state(plan, "svc", mounts=("/d",), fingerprint=fingerprint(actions))
+    assert actions._plan_ops({}) == []
+    assert actions._plan_ops({"plan1": "x", "plan1/svc": "x"}) == [
+        Op(DELETE_SERVICE, "plan1", "svc"),
+        Op(CREATE_SERVICE, "plan1", "svc"),
+        Op(RESTART, "plan1", "svc"),
+    ]
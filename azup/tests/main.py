@@ -32,7 +32,17 @@ def t_main(test_args=sys.argv[1:], now=datetime.utcnow()):
         if not len(args):
             print_err(f"Replaying: {' '.join(cmd_line)}")
             args = cmd_line
-        play = Player(records)
+        if "latency" in options:
+            # `-latency:1` sleeps recorded time of every command, to compare
+            # how long execution strategies take without touching azure
+            play = Player(
+                records,
+                latency=float(options["latency"] or 1),
+                jitter=float(options.get("jitter", 0)),
+                strict=False,
+            )
+        else:
+            play = Player(records)
     else:
         action = args[0]
         if "record" in options:
@@ -46,6 +56,10 @@ def t_main(test_args=sys.argv[1:], now=datetime.utcnow()):
             return main(test_args)
 
     out = main(args, AzCmd(record_to=rec, replay_from=play, now=now))
+    if out is not None and not isinstance(out, str):
+        out = "".join(out)
+    if play is not None and play.latency is not None:
+        print_err(f"replay: {play.report()}")
 
     if "add_test" in options:
         test_args.remove("-add_test")
@@ -1,6 +1,13 @@
+import json
+from datetime import datetime
+
 import pytest
+import yaml
 
-from azup.cmd import read_tests
+import azup.context as c
+from azup.cmd import AzCmd, read_tests
+from azup.main import IMAGE_FIELDS, main
+from azup.tests.fake_az import AZ_STATE, FakeAz
 from azup.tests.main import t_main
 
 testdata = read_tests()
@@ -12,3 +19,107 @@ def test_recorded(args, now, expected):
         assert t_main(args, now) is None
     else:
         assert expected == t_main(args, now)
+
+
+NOW = datetime(2021, 6, 1)
+CONFIG_YML = {
+    "group": "grp",
+    "acrs": {"acr1": {"repos": {"app": {"purge_after": "1Y"}}}},
+    "storages": {"st1": {"shares": {"share1": {"quota": 100, "key_used": 0}}}},
+    "mongos": {"mongo1": {}},
+    "plans": {
+        "plan1": {
+            "sku": "B2",
+            "kind": "linux",
+            "location": "East US",
+            "services": {
+                "svc1": {
+                    "container": {"acr": "acr1", "repo": "app", "tag": "v1"},
+                    "mounts": {"/d": {"account": "st1", "share": "share1"}},
+                    "mongo_connections": {"MONGO": {"db": "mongo1", "conn_used": 0}},
+                }
+            },
+        }
+    },
+}
+
+
+def run(fake: FakeAz, *args: str) -> str:
+    out = main(list(args), AzCmd(replay_from=fake, now=NOW))  # type:ignore
+    return out if out is None or isinstance(out, str) else "".join(out)
+
+
+@pytest.fixture
+def config_yml(tmp_path, monkeypatch):
+    monkeypatch.setattr(c, "CACHE_DIR", tmp_path)
+    file = tmp_path / "grp.yml"
+    file.write_text(yaml.dump(CONFIG_YML))
+    return str(file)
+
+
+def test_batch_runs_every_target(config_yml, tmp_path):
+    other = tmp_path / "other.yml"
+    other.write_text(yaml.dump({**CONFIG_YML, "plans": {}}))
+    fake = FakeAz()
+    out = run(fake, "batch", "list_images", config_yml, str(other), "missing.yml")
+    sections = out.split("# ")
+    assert sections[1].startswith(f"{config_yml}\nRepo: acr1.azurecr.io/app\n")
+    assert sections[2].startswith(f"{other}\nRepo: acr1.azurecr.io/app\n")
+    summary = out.split("SUMMARY:\n")[1].splitlines()
+    assert [line.split()[:2] for line in summary] == [
+        [config_yml, "ok"],
+        [str(other), "ok"],
+        ["missing.yml", "failed:"],
+    ]
+    assert sum(cmd.startswith("az account list-locations") for cmd in fake.cmds) == 1
+
+
+def test_watch_converges(config_yml):
+    fake = FakeAz()
+    run(fake, "watch", config_yml, "-runs:2", "-interval:0s")
+    assert fake.state["plans"]["plan1"]["sku"] == "B2"
+    assert set(fake.state["plans"]) == {"plan1"}
+    assert set(fake.state["webapps"]) == {"svc1"}
+    assert run(fake, "diff", config_yml) == ""
+    verbs = {"create", "delete", "update", "restart"}
+    mutations = [cmd for cmd in fake.cmds if verbs & set(cmd.split()[:4])]
+    # second reconcile found nothing to do
+    assert len(mutations) == len(set(mutations))
+
+
+def test_diff_changes_nothing(config_yml):
+    fake = FakeAz()
+    assert run(fake, "diff", config_yml) == (
+        "~ plans>plan1\n    sku: B1 -> B2\n- plans>plan2\n"
+    )
+    drift = json.loads(run(fake, "diff", config_yml, "-format:json"))
+    assert {"path": ["plans", "plan2"], "change": "delete"} in drift
+    assert fake.state == AZ_STATE
+
+
+def test_dump_config_stream_same_as_whole():
+    whole = run(FakeAz(), "dump_config", "grp")
+    streamed = run(FakeAz(), "dump_config", "grp", "-stream")
+    assert yaml.safe_load(streamed) == yaml.safe_load(whole)
+    assert yaml.safe_load(whole)["plans"]["plan1"]["services"]["svc1"]["mounts"]
+
+
+def test_list_images_formats(config_yml):
+    rows = [
+        json.loads(line)
+        for line in run(FakeAz(), "list_images", config_yml, "-format:jsonl")
+        .rstrip("\n")
+        .split("\n")
+    ]
+    assert [(r["repo"], r["digest"]) for r in rows] == [
+        ("app", "sha256:aaa"),
+        ("app", "sha256:bbb"),
+    ]
+    header, *lines = run(FakeAz(), "list_images", config_yml, "-format:tsv").split("\n")
+    assert header.split("\t") == list(IMAGE_FIELDS)
+    assert lines[-1] == ""
+    for line, row in zip(lines, rows):
+        cells = line.split("\t")
+        assert len(cells) == len(IMAGE_FIELDS)
+        assert cells[2] == row["digest"]
+        assert cells[6:] == [str(int(row["purge"])), str(int(row["in_use"]))]
@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from azup.cmd import CmdRun, RateControl
+from azup.rest import RestClient, RestError, TokenCache, basic_auth
+from azup.tests.cmd_tests import replay_context
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    Answers from `routes` of server: path with query -> list of
+    (status, json body, headers), last one repeats
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1  # type:ignore
+
+    def respond(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        server.requests.append(  # type:ignore
+            (self.command, self.path, self.headers.get("Authorization"))
+        )
+        answers = server.routes.get(self.path.split("api-version")[0])  # type:ignore
+        if answers is None:
+            status, body, headers = 404, {"error": {"code": "NotFound"}}, {}
+        else:
+            status, body, headers = answers.pop(0) if len(answers) > 1 else answers[0]
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    httpd.connections = 0  # type:ignore
+    httpd.requests = []  # type:ignore
+    httpd.routes = {}  # type:ignore
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"  # type:ignore
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def client(server, fetched=None) -> RestClient:
+    def fetch(resource):
+        if fetched is not None:
+            fetched.append(resource)
+        return "tok", time.time() + 3600
+
+    return RestClient(TokenCache(fetch), arm=server.url, acr=server.url + "/{registry}")
+
+
+def test_arm_list_follows_next_link_over_one_connection(server):
+    path = "/subscriptions/s/resourceGroups/g/providers/Microsoft.Web/sites"
+    server.routes[path + "?"] = [
+        (200, {"value": [1, 2], "nextLink": f"{server.url}{path}?page=2"}, {})
+    ]
+    server.routes[path + "?page=2"] = [(200, {"value": [3]}, {})]
+    fetched = []
+    rest = client(server, fetched)
+    assert rest.arm_list(path, "2022-03-01", 5) == [1, 2, 3]
+    assert rest.arm_list(path, "2022-03-01", 5) == [1, 2, 3]
+    assert len(server.requests) == 4
+    assert {auth for _, _, auth in server.requests} == {"Bearer tok"}
+    assert len(fetched) == 1
+    assert server.connections == 1
+
+
+def test_acr_list_follows_link_header(server):
+    server.routes["/acr1/acr/v1/_catalog?n=100"] = [
+        (
+            200,
+            {"repositories": ["a"]},
+            {"Link": '</acr1/acr/v1/_catalog?last=a>; rel="next"'},
+        )
+    ]
+    server.routes["/acr1/acr/v1/_catalog?last=a"] = [(200, {"repositories": ["b"]}, {})]
+    rest = client(server)
+    listed = rest.acr_list(
+        "acr1", "/acr/v1/_catalog", "repositories", ("acr1", "pwd"), 5
+    )
+    assert listed == ["a", "b"]
+    assert server.requests[0][2] == basic_auth("acr1", "pwd")
+    with pytest.raises(RestError) as e:
+        rest.acr_get("acr1", "/acr/v1/missing", ("acr1", "pwd"), 5)
+    assert e.value.status == 404
+
+
+def test_az_cmd_reads_through_rest(server):
+    group = "/subscriptions/sub1/resourceGroups/grp/providers"
+    plan = {
+        "id": f"{group}/Microsoft.Web/serverfarms/plan1",
+        "type": "Microsoft.Web/serverfarms",
+        "name": "plan1",
+        "kind": "linux",
+        "location": "East US",
+        "sku": {"name": "B1", "tier": "Basic"},
+        "properties": {"numberOfSites": 1},
+    }
+    throttled = {"error": {"code": "TooManyRequests", "message": "slow down"}}
+    server.routes[f"{group}/Microsoft.Web/serverfarms?"] = [
+        (429, throttled, {"Retry-After": "0"}),
+        (200, {"value": [plan]}, {}),
+    ]
+    server.routes[f"{group}/Microsoft.Web/sites/svc/config/appsettings/list?"] = [
+        (200, {"properties": {"A": "1"}}, {})
+    ]
+    ctx = replay_context([])
+    az_cmd = ctx.az_cmd
+    az_cmd.replay_from = None
+    az_cmd.rate = RateControl(base_delay=0.01)
+    az_cmd.rest = client(server)
+    account = CmdRun("az account show", 0, json.dumps({"id": "sub1"}))
+    az_cmd.shared.put("az account show", account)
+    assert az_cmd.get_plan_list() == [
+        {
+            "name": "plan1",
+            "kind": "linux",
+            "location": "East US",
+            "resourceGroup": "grp",
+            "sku": {"name": "B1"},
+        }
+    ]
+    assert az_cmd.rate.stats()["throttled"] == 1
+    settings = [{"name": "A", "value": "1", "slotSetting": False}]
+    assert az_cmd.site_config_list("svc", "appsettings")(5) == settings
+    assert az_cmd.get_plan_list()[0]["name"] == "plan1"  # from memo
+    assert len(server.requests) == 3
@@ -0,0 +1,103 @@
+"""
+Replays recorded test cases in process pool:
+
+    python -m azup.tests.runner [-max_workers:8] [-k:<substring of args>]
+
+Every case runs `t_main` with its pinned `now` in worker process, so each
+one builds its own `Context`.
+"""
+
+import difflib
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from azup import filter_options
+from azup.cmd import read_tests
+
+Case = Tuple[List[str], datetime, Optional[str]]
+
+
+class CaseResult(NamedTuple):
+    idx: int
+    args: List[str]
+    elapsed: float
+    ok: bool
+    diff: str
+
+
+def run_case(idx: int, case: Case) -> CaseResult:
+    from azup.tests.main import t_main
+
+    args, now, expected = case
+    start = time.monotonic()
+    try:
+        actual = t_main(list(args), now)
+        ok = actual == expected
+    except Exception:
+        actual = traceback.format_exc()
+        ok = False
+    elapsed = time.monotonic() - start
+    diff = ""
+    if not ok:
+        diff = (
+            "".join(
+                difflib.unified_diff(
+                    (expected or "").splitlines(keepends=True),
+                    (actual or "").splitlines(keepends=True),
+                    "expected",
+                    "actual",
+                )
+            )
+            or f"expected {expected!r}, got {actual!r}\n"
+        )
+    return CaseResult(idx, list(args), elapsed, ok, diff)
+
+
+def run_cases(cases: List[Case], max_workers: int = None) -> List[CaseResult]:
+    if max_workers == 1:
+        return [run_case(i, case) for i, case in enumerate(cases)]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(run_case, i, case) for i, case in enumerate(cases)]
+        return [f.result() for f in futures]
+
+
+def report(results: List[CaseResult], elapsed: float) -> str:
+    """
+    >>> print(report([CaseResult(0, ["a"], 0.5, True, ""),
+    ...     CaseResult(1, ["b"], 1.25, False, "-x\\n+y\\n")], 1.5))
+    ok    0.50s a
+    FAIL  1.25s b
+    -x
+    +y
+    1 passed, 1 failed in 1.50s
+    """
+    lines = []
+    for r in results:
+        lines.append(
+            f"{'ok' if r.ok else 'FAIL':4s} {r.elapsed:5.2f}s {' '.join(r.args)}"
+        )
+        if r.diff:
+            lines.append(r.diff.rstrip("\n"))
+    failed = sum(not r.ok for r in results)
+    lines.append(f"{len(results) - failed} passed, {failed} failed in {elapsed:.2f}s")
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = sys.argv[1:]) -> int:
+    _, options = filter_options(argv)
+    cases = read_tests()
+    if "k" in options:
+        cases = [c for c in cases if options["k"] in " ".join(c[0])]
+    max_workers = int(options["max_workers"]) if "max_workers" in options else None
+    start = time.monotonic()
+    results = run_cases(cases, max_workers)
+    print(report(results, time.monotonic() - start))
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
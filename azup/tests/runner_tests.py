@@ -0,0 +1,31 @@
+from datetime import datetime
+
+import azup.cmd
+from azup.cmd import add_test, read_tests
+from azup.tests.runner import run_cases
+
+
+def test_run_cases_reports_diff():
+    now = datetime(2022, 1, 1)
+    cases = [(["test_help"], now, ""), (["test_help"], now, "x\n")]
+    for max_workers in (1, 2):
+        ok, failed = run_cases(cases, max_workers)
+        assert (ok.idx, ok.ok, ok.diff) == (0, True, "")
+        assert (failed.idx, failed.ok) == (1, False)
+        assert "-x" in failed.diff
+
+
+def test_add_test_appends_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(azup.cmd, "REC_DIR", tmp_path)
+    monkeypatch.setattr(azup.cmd, "TESTER", tmp_path / "tester.json")
+    monkeypatch.setattr(azup.cmd, "TESTER_LOG", tmp_path / "tester.jsonl")
+    (tmp_path / "tester.json").write_text(
+        '[{"args": ["a"], "out": "1", "now": "2022-01-01T00:00:00"}]'
+    )
+    add_test(["b"], "2")
+    add_test(["c"], None)
+    assert [(args, out) for args, _, out in read_tests()] == [
+        (["a"], "1"),
+        (["b"], "2"),
+        (["c"], None),
+    ]
@@ -0,0 +1,47 @@
+import subprocess
+import sys
+
+# Budget for `import azup.main`, enough to print usage, in microseconds
+IMPORT_BUDGET_US = 100_000
+
+HEAVY_MODULES = (
+    "yaml",
+    "dateutil",
+    "subprocess",
+    "inspect",
+    "azup.cmd",
+    "azup.context",
+    "azup.yaml",
+)
+
+
+def import_times(module: str):
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_usage_does_not_import_heavy_modules():
+    times = import_times("azup.main")
+    assert [m for m in HEAVY_MODULES if m in times] == []
+
+
+def test_import_time_budget():
+    best = min(import_times("azup.main")["azup.main"] for _ in range(3))
+    assert best < IMPORT_BUDGET_US
+
+
+def test_usage():
+    process = subprocess.run(
+        [sys.executable, "-m", "azup.main"], capture_output=True, check=True
+    )
+    assert b"USAGES:" in process.stderr
@@ -1,4 +1,4 @@
-from typing import Any, Callable, Dict, Iterable, Type
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple, Type
 
 import yaml
 from yaml.loader import SafeLoader
@@ -18,7 +18,11 @@ def build_factory_dict(yamlables: Iterable[Type]) -> Dict[Type, Callable]:
 
 def load_from_file(f, root: "CtxPath", cls: Type):
     with open(f) as fp:
-        return cls.from_dict(root, yaml.load(fp, Loader=SafeLoader))  # type:ignore
+        return load_from_text(fp, root, cls)
+
+
+def load_from_text(text: Any, root: "CtxPath", cls: Type):
+    return cls.from_dict(root, yaml.load(text, Loader=SafeLoader))  # type:ignore
 
 
 def setattrs_from_dict(o: Any, path: "CtxPath", d: Dict[str, Any]):
@@ -107,8 +111,72 @@ def to_dict(o: Any, yamlables: Iterable[Type]) -> Dict[str, Any]:
     return convert(o)
 
 
+def flat_dict(d: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """
+    >>> flat_dict({"a": {"b": 1, "c": {}}, "d": 2})
+    {'a.b': 1, 'a.c': {}, 'd': 2}
+    """
+    out: Dict[str, Any] = {}
+    for k, v in d.items():
+        if isinstance(v, dict) and len(v):
+            out.update(flat_dict(v, f"{prefix}{k}."))
+        else:
+            out[f"{prefix}{k}"] = v
+    return out
+
+
+def diff_dicts(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Tuple]:
+    """
+    >>> diff_dicts({"a": {"b": 1, "c": 2}}, {"a": {"b": 1, "d": 3}})
+    {'a.c': (2, None), 'a.d': (None, 3)}
+    """
+    left, right = flat_dict(left), flat_dict(right)
+    return {
+        k: (left.get(k), right.get(k))
+        for k in sorted(set(left) | set(right))
+        if left.get(k) != right.get(k)
+    }
+
+
 def to_yaml(o, yamlables: Iterable[Type]):
     return yaml.safe_dump(to_dict(o, yamlables))
 
 
+def yaml_entry(key: str, value: Any, indent: int = 0) -> str:
+    """
+    Single mapping entry, indented to be concatenated into bigger document
+
+    >>> print(yaml_entry("a", {"b": [1], "c": "x"}, 2), end="")
+      a:
+        b:
+        - 1
+        c: x
+    """
+    pad = " " * indent
+    text = yaml.safe_dump({key: value})
+    return "".join(pad + line for line in text.splitlines(keepends=True))
+
+
+def iter_yaml_mapping(
+    name: str, entries: Iterable[Tuple[str, Any]], indent: int = 0
+) -> Iterator[str]:
+    """
+    >>> print("".join(iter_yaml_mapping("m", [("a", 1), ("b", {})])), end="")
+    m:
+      a: 1
+      b: {}
+    >>> print("".join(iter_yaml_mapping("m", [], 2)), end="")
+      m: {}
+    """
+    pad = " " * indent
+    empty = True
+    for k, v in entries:
+        if empty:
+            yield f"{pad}{name}:\n"
+            empty = False
+        yield yaml_entry(k, v, indent + 2)
+    if empty:
+        yield f"{pad}{name}: {{}}\n"
+
+
 from azup.context import ContextAware, CtxPath